@@ -0,0 +1,167 @@
+#!/usr/bin/python3.4
+
+# -- captureBenchmark.py - Panorama capture throughput benchmark for ace-ng --
+# Author:     Owen Tourlamain
+# Supervisor: Dr. Laurence Tyler
+
+"""
+captureBenchmark.py
+
+Runs the panorama capture engine against the simulated AUPE for every
+combination of the plan sizes given, and writes frames per second, where the
+time went and the peak memory of each run to a JSON file so runs can be
+compared over time.
+
+    benchmarks/captureBenchmark.py --positions 9,25 --captures 6 --sizes 1024x1024 --out results.json
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import resource
+import tempfile
+import shutil
+import subprocess
+import itertools
+import multiprocessing
+
+basePath = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, basePath)
+from lib import simulatedApi as api
+from lib.captureEngine import CaptureEngine
+from lib.captureOrder import CaptureOrderer
+
+# Phases reported for every run, in the order they happen
+PHASES = ("move", "configure", "expose", "transfer", "encode", "write")
+
+# Cameras used by each mix, as (camera, filters)
+CAMERA_MIXES = {
+    "wac": [(0, range(1, 12)), (1, range(1, 12))],
+    "hrc": [(2, [0])],
+    "mixed": [(0, range(1, 12)), (1, range(1, 12)), (2, [0])],
+}
+
+def buildPlan(positions, captures, mix):
+    # Imported here so the worker processes pay for it, not the parent
+    from lib.panorama import Panorama, PanoramaPosition, Capture
+
+    panorama = Panorama()
+    columns = max(1, int(positions ** 0.5))
+    # Alternate between the cameras, working through each one's filters
+    cameras = [[(camera, filter) for filter in filters] for (camera, filters) in CAMERA_MIXES[mix]]
+    slots = [slot for group in itertools.zip_longest(*cameras) for slot in group if slot]
+    for i in range(positions):
+        position = PanoramaPosition(-10.0 * (i % columns), 5.0 * (i // columns), "")
+        for j in range(captures):
+            (camera, filter) = slots[j % len(slots)]
+            position.captures.append(Capture("C%d" % j, camera, filter, shutter=50.0))
+        panorama.positions.append(position)
+    panorama.sort()
+    return panorama
+
+def runScenario(scenario):
+    # Runs in its own process, so the peak RSS belongs to this run alone
+    api.configure(timeScale=scenario["timeScale"])
+    (width, height) = scenario["size"]
+    api.pancam.CAMERAS = tuple((name, (width, height), mode, wheel)
+                               for (name, size, mode, wheel) in api.SimulatedPancam.CAMERAS)
+    api.system.connect(agent_addr="benchmark")
+    api.pancam.setup_cameras()
+
+    panorama = buildPlan(scenario["positions"], scenario["captures"], scenario["mix"])
+    path = tempfile.mkdtemp(prefix="ace-bench-")
+    orderer = CaptureOrderer({0: 11, 1: 11}) if scenario["orderCaptures"] else None
+    engine = CaptureEngine(api, panorama, path,
+                           writerThreads=scenario["writers"],
+                           queueSize=scenario["queueSize"],
+                           parallelCameras=scenario["parallelCameras"],
+                           captureOrderer=orderer,
+                           outputFormat=scenario["outputFormat"])
+    try:
+        start = time.perf_counter()
+        engine.run()
+        elapsed = time.perf_counter() - start
+    finally:
+        shutil.rmtree(path, ignore_errors=True)
+
+    frames = scenario["positions"] * scenario["captures"]
+    totals = dict(engine.timings.totals)
+    totals.update(api.model.phases.totals)
+    return dict(
+        scenario=scenario,
+        frames=frames,
+        seconds=elapsed,
+        framesPerSecond=frames / elapsed if elapsed else 0.0,
+        phases=dict((phase, totals.get(phase, 0.0)) for phase in PHASES),
+        waits=dict((stage, totals.get(stage, 0.0)) for stage in ("queueWait", "writerIdle")),
+        # ru_maxrss is in kilobytes on Linux
+        peakRssKb=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    )
+
+def runIsolated(scenario):
+    pool = multiprocessing.Pool(1)
+    try:
+        return pool.apply(runScenario, (scenario,))
+    finally:
+        pool.terminate()
+
+def environment():
+    try:
+        commit = subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=basePath,
+                                         stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return dict(
+        python=platform.python_version(),
+        platform=platform.platform(),
+        cpus=multiprocessing.cpu_count(),
+        commit=commit,
+        time=time.strftime("%Y-%m-%dT%H:%M:%S"),
+    )
+
+def intList(text):
+    return [int(item) for item in text.split(",")]
+
+def sizeList(text):
+    return [tuple(int(part) for part in item.split("x")) for item in text.split(",")]
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark panorama capture throughput")
+    parser.add_argument("--positions", type=intList, default=[9, 25])
+    parser.add_argument("--captures", type=intList, default=[6])
+    parser.add_argument("--sizes", type=sizeList, default=[(1024, 1024)])
+    parser.add_argument("--mixes", default="wac,mixed")
+    parser.add_argument("--writers", type=int, default=2)
+    parser.add_argument("--queue-size", type=int, default=4)
+    parser.add_argument("--parallel-cameras", action="store_true")
+    parser.add_argument("--order-captures", action="store_true")
+    parser.add_argument("--output-format", choices=["png", "raw"], default="png")
+    parser.add_argument("--time-scale", type=float, default=0.1,
+                        help="Fraction of the simulated hardware delays to really wait, 0 measures ace-ng alone")
+    parser.add_argument("--out", default="capture-benchmark.json")
+    args = parser.parse_args()
+
+    results = []
+    for (positions, captures, size, mix) in itertools.product(args.positions, args.captures,
+                                                              args.sizes, args.mixes.split(",")):
+        scenario = dict(positions=positions, captures=captures, size=size, mix=mix,
+                        writers=args.writers, queueSize=args.queue_size,
+                        parallelCameras=args.parallel_cameras, orderCaptures=args.order_captures,
+                        outputFormat=args.output_format,
+                        timeScale=args.time_scale)
+        result = runIsolated(scenario)
+        results.append(result)
+        print("%3d x %2d %-5s %4dx%-4d %6.2f frames/s  peak %6.1f MB  %s" % (
+            positions, captures, mix, size[0], size[1], result["framesPerSecond"],
+            result["peakRssKb"] / 1024.0,
+            " ".join("%s=%.2fs" % (phase, result["phases"][phase]) for phase in PHASES)))
+
+    with open(args.out, "w") as file:
+        json.dump(dict(environment=environment(), results=results), file, indent=2, sort_keys=True)
+    print("Results written to %s" % args.out)
+
+if __name__ == "__main__":
+    main()
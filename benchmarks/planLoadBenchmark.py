@@ -0,0 +1,106 @@
+#!/usr/bin/python3.4
+
+# -- planLoadBenchmark.py - Panorama plan loading benchmark for ace-ng --
+# Author:     Owen Tourlamain
+# Supervisor: Dr. Laurence Tyler
+
+"""
+planLoadBenchmark.py
+
+Saves generated panorama plans of each size in both the XML .pan format and
+the compact .panl format, times loading them back and writes the results to
+a JSON file. --legacy also times building each plan one add() at a time,
+the way plans used to be loaded, which gets very slow past a few thousand
+positions.
+
+    benchmarks/planLoadBenchmark.py --positions 1000,10000,20000 --out plans.json
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import shutil
+
+basePath = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, basePath)
+from lib.panorama import Panorama, PanoramaPosition, Capture, PanoramaSaver
+
+def buildPlan(positions, captures):
+    columns = max(1, int(positions ** 0.5))
+    plan = []
+    for i in range(positions):
+        position = PanoramaPosition(-1.0 * (i % columns), 0.5 * (i // columns), "P%d" % i)
+        for j in range(captures):
+            position.captures.append(Capture("C%d" % j, j % 3, 1 + j % 11, shutter=50.0))
+        plan.append(position)
+    return plan
+
+def timed(function, repeats):
+    # Best of the repeats, the others are mostly noise from the rest of the machine
+    best = None
+    for i in range(repeats):
+        start = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def runSize(positions, captures, repeats, legacy, path):
+    plan = buildPlan(positions, captures)
+    panorama = Panorama()
+    panorama.extend(plan)
+    saver = PanoramaSaver()
+    xmlFile = os.path.join(path, "plan.pan")
+    linesFile = os.path.join(path, "plan.panl")
+    saver.dump(panorama, xmlFile)
+    saver.dumpLines(panorama, linesFile)
+
+    result = dict(
+        positions=positions,
+        captures=captures,
+        bytes=dict(xml=os.path.getsize(xmlFile), lines=os.path.getsize(linesFile)),
+        seconds=dict(
+            xml=timed(lambda: saver.load(xmlFile), repeats),
+            lines=timed(lambda: saver.load(linesFile), repeats),
+        ),
+    )
+    if legacy:
+        def addEach():
+            slow = Panorama()
+            for position in plan:
+                slow.add(position)
+        result["seconds"]["legacyAdd"] = timed(addEach, 1)
+    return result
+
+def intList(text):
+    return [int(item) for item in text.split(",")]
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark panorama plan loading")
+    parser.add_argument("--positions", type=intList, default=[1000, 10000])
+    parser.add_argument("--captures", type=int, default=6)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--legacy", action="store_true")
+    parser.add_argument("--out", default="plan-benchmark.json")
+    args = parser.parse_args()
+
+    path = tempfile.mkdtemp(prefix="ace-plans-")
+    results = []
+    try:
+        for positions in args.positions:
+            result = runSize(positions, args.captures, args.repeats, args.legacy, path)
+            results.append(result)
+            print("%6d positions  %s" % (positions, "  ".join(
+                "%s=%.3fs" % (name, seconds) for (name, seconds) in sorted(result["seconds"].items()))))
+    finally:
+        shutil.rmtree(path, ignore_errors=True)
+
+    with open(args.out, "w") as file:
+        json.dump(dict(results=results), file, indent=2, sort_keys=True)
+    print("Results written to %s" % args.out)
+
+if __name__ == "__main__":
+    main()
@@ -6,7 +6,11 @@ from PyQt5.QtWidgets import *
 from PyQt5.QtCore import *
 from PyQt5.QtGui import *
 from time import sleep
-from xml.etree import ElementTree as xml
+from lib.captureEngine import CaptureListener, engineFromConfig
+from lib.captureJournal import CaptureJournal
+from lib.panorama import Panorama, PanoramaPosition, Capture, PanoramaSaver
+from lib.panoramaGrid import buildGrid, templateFov
+from lib.pathOptimiser import optimiserFromConfig
 import os
 
 class Tab(QWidget):
@@ -19,21 +23,29 @@ class Tab(QWidget):
         self.strings = strings
         self.api = api
         self.title = self.strings.MIT_Title
+        # Decides the order the PTU visits the positions in
+        self.optimiser = optimiserFromConfig(self.config, self.verbose)
         # This holds all the information about the panorama, don't loose it
-        self.panorama = Panorama()
+        self.panorama = Panorama(self.optimiser)
 
         layout = QHBoxLayout()
 
         # Left hand column, deals with all the positions in the panorama
-        self.positionsListBox = QListWidget()
-        self.positionsListBox.currentItemChanged.connect(self.selectPosition)
+        self.positionsModel = ItemListModel(self.panorama.positions)
+        self.positionsListBox = QListView()
+        self.positionsListBox.setUniformItemSizes(True)
+        self.positionsListBox.setModel(self.positionsModel)
+        self.positionsListBox.selectionModel().currentChanged.connect(self.positionChanged)
         self.addPositionButton = QPushButton(self.strings.MIT_AddPosition)
         self.addPositionButton.clicked.connect(self.newPositionButton)
         self.removePositionButton = QPushButton(self.strings.MIT_RemovePosition)
         self.removePositionButton.clicked.connect(self.deletePositionButton)
+        self.addGridButton = QPushButton(self.strings.MIT_AddGrid)
+        self.addGridButton.clicked.connect(self.newGridButton)
 
         positionsButtonsLayout = QHBoxLayout()
         positionsButtonsLayout.addWidget(self.removePositionButton)
+        positionsButtonsLayout.addWidget(self.addGridButton)
         positionsButtonsLayout.addWidget(self.addPositionButton)
 
         positionsLayout = QVBoxLayout()
@@ -58,8 +70,11 @@ class Tab(QWidget):
         self.positionUpdateButton.clicked.connect(self.updatePosition)
         self.positionUpdateButton.setEnabled(False)
 
-        self.capturesListBox = QListWidget()
-        self.capturesListBox.currentItemChanged.connect(self.selectCapture)
+        self.capturesModel = ItemListModel()
+        self.capturesListBox = QListView()
+        self.capturesListBox.setUniformItemSizes(True)
+        self.capturesListBox.setModel(self.capturesModel)
+        self.capturesListBox.selectionModel().currentChanged.connect(self.captureChanged)
         self.capturesListBox.setSizePolicy(QSizePolicy(QSizePolicy.Expanding, QSizePolicy.Expanding))
 
         self.addCaptureButton = QPushButton(self.strings.MIT_AddCapture)
@@ -238,7 +253,8 @@ class Tab(QWidget):
         self.setLayout(layout)
 
     def updateAeMode(self, current):
-        if current == 1:
+        # Server and client AE both use the AE settings
+        if current in (1, 3):
             self.captureAeGroup.setHidden(False)
         else:
             self.captureAeGroup.setHidden(True)
@@ -263,14 +279,46 @@ class Tab(QWidget):
             message.setText(self.strings.MIT_PositionExists)
             message.exec()
             return
-        # Add to the panorama, and the list box
+        # Add to the panorama, and the list box. Adding can reorder the whole
+        # path, so the list box has to be rebuilt rather than inserted into
         self.panorama.add(position)
-        index = self.panorama.getIndex(position)
-        self.positionsListBox.insertItem(index, position)
+        self.refreshPositions()
+        self.positionsListBox.setCurrentIndex(self.positionsModel.indexOf(position))
+
+    def newGridButton(self):
+        # The selected position's captures are copied to every position in the grid
+        currentItems = self.positionsModel.items(self.positionsListBox.selectedIndexes())
+        if currentItems == [] or not currentItems[0].captures:
+            message = QMessageBox()
+            message.setText(self.strings.MIT_GridTemplate)
+            message.exec()
+            return
+        dialog = GridDialog(self.strings, self.config.MIT_GridOverlap)
+        ret = dialog.call()
+        if ret == None:
+            return
+        (panRange, tiltRange, overlap) = ret
+        captures = currentItems[0].captures
+        positions = buildGrid(panRange, tiltRange, templateFov(self.config, captures), overlap / 100.0, captures)
+        # Throw away duplicates, and names already used, as they name the folders
+        angles = set((position.pan, position.tilt) for position in self.panorama.positions)
+        names = set(position.name for position in self.panorama.positions)
+        positions = [position for position in positions if (position.pan, position.tilt) not in angles]
+        if positions == []:
+            message = QMessageBox()
+            message.setText(self.strings.MIT_GridEmpty)
+            message.exec()
+            return
+        for position in positions:
+            if position.name in names:
+                position.name = ""
+        self.panorama.extend(positions)
+        self.refreshPositions()
+        self.blankPosition()
+        self.blankCapture()
 
     def newCaptureButton(self):
-        currentItems = self.positionsListBox.selectedItems()
-        if currentItems == []:
+        if not self.positionsListBox.selectedIndexes():
             # User cancelled the dialog
             return
         dialog = CaptureDialog(self.strings)
@@ -284,36 +332,37 @@ class Tab(QWidget):
             message.setText(self.strings.MIT_CaptureExists)
             message.exec()
             return
-        self.currentPosition.captures.append(capture)
-        self.capturesListBox.addItem(capture)
+        self.capturesModel.append(capture)
 
     def deletePositionButton(self):
         # Cheack we have something selceted, we can't delete nothing can we?
-        currentItems = self.positionsListBox.selectedItems()
+        currentItems = self.positionsModel.items(self.positionsListBox.selectedIndexes())
         if currentItems == []:
             return
         # Pretty sure this can only contain one item, but I'm sure someone will find a way to multi-select
         for item in currentItems:
-            # Remove the item from both the panorama, and the list box
-            row = self.positionsListBox.row(item)
-            self.positionsListBox.takeItem(row)
-            self.panorama.remove(item)
+            # The model holds the panorama's own list, so this removes it from both
+            self.positionsModel.removeItem(item)
         # Blank the rest of the form so it doesnt have ghost data floating around
         self.blankPosition()
         self.blankCapture()
 
     def deleteCaptureButton(self):
         # Again, check we have something
-        currentItems = self.capturesListBox.selectedItems()
+        currentItems = self.capturesModel.items(self.capturesListBox.selectedIndexes())
         if currentItems == []:
             return
         for item in currentItems:
-            row = self.capturesListBox.row(item)
-            self.capturesListBox.takeItem(row)
-            self.currentPosition.captures.remove(item)
+            self.capturesModel.removeItem(item)
         # Blank the right hand panel
         self.blankCapture()
 
+    def positionChanged(self, current, previous):
+        self.selectPosition(self.positionsModel.item(current), self.positionsModel.item(previous))
+
+    def captureChanged(self, current, previous):
+        self.selectCapture(self.capturesModel.item(current), self.capturesModel.item(previous))
+
     def selectPosition(self, currentItem, previousItem):
         # Do nothing if we have nothing
         if not currentItem:
@@ -321,12 +370,8 @@ class Tab(QWidget):
         self.positionPan.setText(str(currentItem.pan))
         self.positionTilt.setText(str(currentItem.tilt))
         self.positionName.setText(currentItem.name)
-        # Blank the list box before we add new items, we can't use clear(),
-        # Qt has a hissy fit about deleted objects if we do (even though they arent deleted)
-        for row in range(self.capturesListBox.count()):
-            self.capturesListBox.takeItem(0)
-        for capture in currentItem.captures:
-            self.capturesListBox.addItem(capture)
+        # The captures list shows the position's own list of captures
+        self.capturesModel.setItems(currentItem.captures)
         # Save for later
         self.currentPosition = currentItem
         # Make the buttons work
@@ -386,7 +431,7 @@ class Tab(QWidget):
         self.currentPosition.tilt = float(self.positionTilt.text())
         self.currentPosition.name = self.positionName.text()
         # Make sure we can actually see these changes
-        self.currentPosition.updateText()
+        self.positionsModel.refresh(self.currentPosition)
 
     def updateCapture(self):
         # Ignore duplicates, need to make a whole item to compare to
@@ -419,7 +464,7 @@ class Tab(QWidget):
         self.currentCapture.aeRate = self.blankFloat(self.captureAeRate.text())
         self.currentCapture.aeOutliers = self.blankFloat(self.captureAeOutliers.text())
         # Make sure we can actually see these changes
-        self.currentCapture.updateText()
+        self.capturesModel.refresh(self.currentCapture)
 
     def blankInt(self, val):
         if val == "":
@@ -435,8 +480,7 @@ class Tab(QWidget):
 
     def blankPosition(self):
         # Disable these items so it's obvious they don't do anything for now
-        for row in range(self.capturesListBox.count()):
-            self.capturesListBox.takeItem(0)
+        self.capturesModel.setItems([])
         self.positionName.setText("")
         self.positionName.setEnabled(False)
         self.positionTilt.setText("")
@@ -512,104 +556,110 @@ class Tab(QWidget):
                 message.exec()
                 return
 
-        dialog = CapturePanorama(self.strings, self.api, self.panorama)
+        # Offer to pick up where an earlier run into the same folder stopped
+        resume = False
+        if self.config.MIT_Journal:
+            done = len(CaptureJournal(self.panorama.path).read())
+            if done:
+                response = QMessageBox.question(self, self.strings.MIT_ResumeTitle, self.strings.MIT_Resume % done,
+                                                QMessageBox.Yes, QMessageBox.No)
+                resume = response == QMessageBox.Yes
+
+        dialog = CapturePanorama(self.config, self.strings, self.api, self.panorama, resume)
         dialog.call()
 
     def saveSettings(self):
-        file = QFileDialog.getSaveFileName(self, self.strings.MIT_SaveFile, os.path.expanduser("~"), "%s (*.pan)" % self.strings.MIT_Panoramas)
+        file = QFileDialog.getSaveFileName(self, self.strings.MIT_SaveFile, os.path.expanduser("~"),
+                                           "%s (*.pan);;%s (*.panl)" % (self.strings.MIT_Panoramas, self.strings.MIT_CompactPanoramas))
         if file[0]:
             saver = PanoramaSaver()
-            saver.dump(self.panorama, file[0])
+            # The compact format is much quicker to load for big panoramas
+            if file[0].endswith(".panl") or file[1].endswith("(*.panl)"):
+                saver.dumpLines(self.panorama, file[0])
+            else:
+                saver.dump(self.panorama, file[0])
 
     def loadSettings(self):
-        file = QFileDialog.getOpenFileName(self, self.strings.MIT_LoadFile, os.path.expanduser("~"), "%s (*.pan)" % self.strings.MIT_Panoramas)
+        file = QFileDialog.getOpenFileName(self, self.strings.MIT_LoadFile, os.path.expanduser("~"), "%s (*.pan *.panl)" % self.strings.MIT_Panoramas)
         if file[0]:
             saver = PanoramaSaver()
-            self.panorama = saver.load(file[0])
-            # Panorama is loaded, but we need to refresh the GUI, again, can't use clear()
-            for row in range(self.positionsListBox.count()):
-                self.positionsListBox.takeItem(0)
-            for position in self.panorama.positions:
-                self.positionsListBox.addItem(position)
+            self.panorama = saver.load(file[0], self.optimiser)
+            # Panorama is loaded, but we need to refresh the GUI
+            self.refreshPositions()
             self.blankPosition()
             self.blankCapture()
 
-class PanoramaSaver(object):
-
-    def __init__(self):
-        super(PanoramaSaver, self).__init__()
-
-    def dump(self, panorama, file):
-        xmlRoot = xml.Element("root")
-        for position in panorama.positions:
-            attributes = dict(
-                name=position.name,
-                pan=str(position.pan),
-                tilt=str(position.tilt)
-            )
-            xmlPosition = xml.Element("position", attrib=attributes)
-            for capture in position.captures:
-                (roix, roiy, roiw, roih) = capture.roi
-                capAttributes = dict(
-                    name=capture.name,
-                    camera=str(capture.camera),
-                    filter=str(capture.filter),
-                    gain = str(capture.gain),
-                    shutter = str(capture.shutter),
-                    shutter_target = str(capture.shutter_target),
-                    roix = str(roix),
-                    roiy = str(roiy),
-                    roiw = str(roiw),
-                    roih = str(roih),
-                    aeMode = str(capture.aeMode),
-                    aeAlg = str(capture.aeAlg),
-                    aeTarget = str(capture.aeTarget),
-                    aeTol = str(capture.aeTol),
-                    aeMax = str(capture.aeMax),
-                    aeMin = str(capture.aeMin),
-                    aeRate = str(capture.aeRate),
-                    aeOutliers = str(capture.aeOutliers)
-                )
-                xmlCapture = xml.Element("capture", attrib=capAttributes)
-                xmlPosition.append(xmlCapture)
-            xmlRoot.append(xmlPosition)
-        tree = xml.ElementTree(xmlRoot)
-        tree.write(file)
-
-    def load(self, file):
-        panorama = Panorama()
-        tree = xml.parse(file)
-        xmlRoot = tree.getroot()
-        for xmlPosition in xmlRoot.iter("position"):
-            pan = float(xmlPosition.get("pan"))
-            tilt = float(xmlPosition.get("tilt"))
-            name = xmlPosition.get("name")
-            position = PanoramaPosition(pan, tilt, name)
-            for xmlCapture in xmlPosition.iter("capture"):
-                name = xmlCapture.get("name")
-                camera = int(xmlCapture.get("camera"))
-                filter = int(xmlCapture.get("filter"))
-                gain = int(xmlCapture.get("gain"))
-                shutter = float(xmlCapture.get("shutter"))
-                shutter_target = float(xmlCapture.get("shutter_target"))
-                roix = int(xmlCapture.get("roix"))
-                roiy = int(xmlCapture.get("roiy"))
-                roiw = int(xmlCapture.get("roiw"))
-                roih = int(xmlCapture.get("roih"))
-                aeMode = float(xmlCapture.get("aeMode"))
-                aeAlg = float(xmlCapture.get("aeAlg"))
-                aeTarget = float(xmlCapture.get("aeTarget"))
-                aeTol = float(xmlCapture.get("aeTol"))
-                aeMax = float(xmlCapture.get("aeMax"))
-                aeMin = float(xmlCapture.get("aeMin"))
-                aeRate = float(xmlCapture.get("aeRate"))
-                aeOutliers = float(xmlCapture.get("aeOutliers"))
-                capture = Capture(name, camera, filter, gain, shutter, shutter_target,
-                                  roix, roiy, roiw, roih, aeMode, aeAlg, aeTarget,
-                                  aeTol, aeMax, aeMin, aeRate)
-                position.captures.append(capture)
-            panorama.add(position)
-        return panorama
+    def refreshPositions(self):
+        # Sorting and loading both replace the panorama's list, so point the
+        # model at whatever it is now
+        self.positionsModel.setItems(self.panorama.positions)
+
+class ItemListModel(QAbstractListModel):
+    """
+    Shows a plain Python list, such as a panorama's positions or a position's
+    captures, in a QListView. The model holds the list itself rather than a
+    copy, and the view only asks for the rows it has on screen, so nothing is
+    built per item however long the list gets. Anything that changes the list
+    should go through the model, or call setItems() afterwards.
+    """
+
+    def __init__(self, items=None):
+        super(ItemListModel, self).__init__()
+        self.list = items if items is not None else []
+
+    def setItems(self, items):
+        self.beginResetModel()
+        self.list = items
+        self.endResetModel()
+
+    def rowCount(self, parent=QModelIndex()):
+        # A list has no children
+        if parent.isValid():
+            return 0
+        return len(self.list)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole and index.isValid() and index.row() < len(self.list):
+            return str(self.list[index.row()])
+        return None
+
+    def item(self, index):
+        if index.isValid() and index.row() < len(self.list):
+            return self.list[index.row()]
+        return None
+
+    def items(self, indexes):
+        return [self.list[index.row()] for index in indexes if index.isValid()]
+
+    def row(self, item):
+        # By identity, positions compare equal to anything at the same angles
+        for (row, other) in enumerate(self.list):
+            if other is item:
+                return row
+        return -1
+
+    def indexOf(self, item):
+        row = self.row(item)
+        return self.index(row) if row >= 0 else QModelIndex()
+
+    def refresh(self, item):
+        index = self.indexOf(item)
+        if index.isValid():
+            self.dataChanged.emit(index, index)
+
+    def append(self, item):
+        row = len(self.list)
+        self.beginInsertRows(QModelIndex(), row, row)
+        self.list.append(item)
+        self.endInsertRows()
+
+    def removeItem(self, item):
+        row = self.row(item)
+        if row < 0:
+            return
+        self.beginRemoveRows(QModelIndex(), row, row)
+        del self.list[row]
+        self.endRemoveRows()
 
 class PositionDialog(QDialog):
 
@@ -677,6 +727,54 @@ class CaptureDialog(QDialog):
         if self.name.text():
             self.accept()
 
+class GridDialog(QDialog):
+
+    def __init__(self, strings, overlap):
+        super(GridDialog, self).__init__()
+
+        self.panFrom = QLineEdit()
+        self.panTo = QLineEdit()
+        self.tiltFrom = QLineEdit()
+        self.tiltTo = QLineEdit()
+        for edit in (self.panFrom, self.panTo, self.tiltFrom, self.tiltTo):
+            edit.setValidator(QDoubleValidator())
+        self.overlap = QSpinBox()
+        self.overlap.setRange(0, 95)
+        self.overlap.setValue(overlap)
+        okButton = QPushButton(strings.MIT_Ok)
+        okButton.setDefault(True)
+        okButton.clicked.connect(self.check)
+
+        self.setWindowTitle(strings.MIT_GridDialog)
+        self.setWindowModality(Qt.ApplicationModal)
+
+        panLayout = QHBoxLayout()
+        panLayout.addWidget(self.panFrom)
+        panLayout.addWidget(self.panTo)
+        tiltLayout = QHBoxLayout()
+        tiltLayout.addWidget(self.tiltFrom)
+        tiltLayout.addWidget(self.tiltTo)
+
+        layout = QFormLayout()
+        layout.addRow(strings.MIT_PanRange, panLayout)
+        layout.addRow(strings.MIT_TiltRange, tiltLayout)
+        layout.addRow(strings.MIT_Overlap, self.overlap)
+        layout.addRow(okButton)
+
+        self.setLayout(layout)
+
+    def call(self):
+        response = self.exec_()
+        if response:
+            return [(float(self.panFrom.text()), float(self.panTo.text())),
+                    (float(self.tiltFrom.text()), float(self.tiltTo.text())),
+                    self.overlap.value()]
+
+    def check(self):
+        # Make sure we actually have enough data to make a grid
+        if self.panFrom.text() and self.panTo.text() and self.tiltFrom.text() and self.tiltTo.text():
+            self.accept()
+
 class PathDialog(QDialog):
 
     def __init__(self, strings):
@@ -718,18 +816,31 @@ class PathDialog(QDialog):
 
 class CapturePanorama(QDialog):
 
-    def __init__(self, strings, api, panorama):
+    def __init__(self, config, strings, api, panorama, resume=False):
         super(CapturePanorama, self).__init__()
+        self.config = config
         self.strings = strings
         self.api = api
         self.panorama = panorama
-        # Used so we can fill up the progress bar correctly
-        self.total = self.computeTotal()
-        self.step = 100 / self.total
-        self.current = 0
+        # The capture loop runs on its own thread, we just listen to it
+        self.engine = engineFromConfig(self.config, self.api, self.panorama, self.panorama.path, resume=resume)
+        self.worker = CaptureThread(self.engine)
+        self.worker.positionStarted.connect(self.positionStarted)
+        self.worker.captureStarted.connect(self.captureStarted)
+        self.worker.captureSkipped.connect(self.captureSkipped)
+        self.worker.captureFinished.connect(self.captureFinished)
+        self.worker.progressed.connect(self.progressed)
+        self.worker.failed.connect(self.failed)
+        self.worker.finished.connect(self.workerFinished)
+        self.closeWhenStopped = False
+        # Captures already done by an earlier run that is being resumed
+        self.skipped = 0
 
         self.infoLabel = QLabel()
+        # Frames are written behind the capture loop, the last one on disk
+        self.savedLabel = QLabel()
         self.progress = QProgressBar()
+        self.progress.setMaximum(self.engine.total)
         self.cancel = QPushButton(self.strings.MIT_Cancel)
         self.cancel.clicked.connect(self.reject)
 
@@ -738,181 +849,103 @@ class CapturePanorama(QDialog):
 
         layout = QVBoxLayout()
         layout.addWidget(self.infoLabel)
+        layout.addWidget(self.savedLabel)
         layout.addWidget(self.progress)
         layout.addWidget(self.cancel)
 
         self.setLayout(layout)
 
     def call(self):
-        self.show()
-        # Move to each position, then take all the captures neded processEvents() allows the GUI to update
-        for position in self.panorama.positions:
-            QApplication.processEvents()
-            self.infoLabel.setText("%s %s" % (self.strings.MIT_MovingTo, position))
-            QApplication.processEvents()
-            self.moveTo(position)
-            self.current += self.step
-            self.progress.setValue(self.current)
-            QApplication.processEvents()
-            for capture in position.captures:
-                QApplication.processEvents()
-                self.infoLabel.setText("%s %s" % (self.strings.MIT_Capturing, capture))
-                QApplication.processEvents()
-                self.capture(capture, position)
-                self.current += self.step
-                self.progress.setValue(self.current)
-                QApplication.processEvents()
-        self.infoLabel.setText(self.strings.MIT_Done)
-        self.cancel.setText(self.strings.MIT_Close)
-        self.progress.setValue(100)
+        self.worker.start()
         # This stops the dialog closing automatically when done
         self.exec_()
 
-    def moveTo(self, position):
-        self.api.pancam.ptu.pan = position.pan
-        self.api.pancam.ptu.tilt = position.tilt
-
-    def capture(self, capture, position):
-        camera = self.api.pancam.cameras[capture.camera]
-        camera.filter = capture.filter
-        camera.gain = capture.gain
-        camera.shutter = capture.shutter
-        camera.shutter_target = capture.shutter_target
-        if capture.roi[2] and capture.roi[3]:
-            camera.ae_meter_region = 1
-            camera.roi = capture.roi
-        else:
-            camera.ae_meter_region = 0
-
-        if capture.aeMode == 0:
-            serverAE = False
-            camera.shutter_mode = 0
-        elif capture.aeMode == 1:
-            serverAE = True
-            camera.shutter_mode = 0
-        else:
-            serverAE = False
-            camera.shutter_mode = 1
-
-        camera.ae_algorithm = capture.aeAlg
-        camera.ae_target = capture.aeTarget
-        camera.ae_tolerance = capture.aeTol
-        camera.ae_max_shutter = capture.aeMax
-        camera.ae_min_shutter = capture.aeMin
-        camera.ae_adjust_rate = capture.aeRate
-        camera.ae_outliers = capture.aeOutliers
-
-        image = camera.get_image(ae=serverAE)
-        # Create a file/folder structure to store the images
-        fileName = "%s_%d_%d.png" % (capture.name, capture.camera, capture.filter)
-        if not os.path.isdir(os.path.join(self.panorama.path, str(position))):
-            os.makedirs(os.path.join(self.panorama.path, str(position)))
-        image.save_png_with_metadata(os.path.join(self.panorama.path, str(position), fileName))
-
-    def computeTotal(self):
-        total = 0
-        total += len(self.panorama)
-        for position in self.panorama.positions:
-            total += len(position.captures)
-        return total
+    def positionStarted(self, position):
+        self.infoLabel.setText("%s %s" % (self.strings.MIT_MovingTo, position))
 
-class Panorama(object):
+    def captureStarted(self, capture):
+        self.infoLabel.setText("%s %s" % (self.strings.MIT_Capturing, capture))
 
-    def __init__(self):
-        super(Panorama, self).__init__()
+    def captureFinished(self, fileName):
+        self.savedLabel.setText("%s %s" % (self.strings.MIT_Saved, os.path.relpath(fileName, self.panorama.path)))
 
-        self.positions = []
+    def captureSkipped(self, capture):
+        self.skipped += 1
+        self.infoLabel.setText("%s %s" % (self.strings.MIT_Skipped, capture))
 
-    def __getitem__(self, item):
-        if item < len(self):
-            raise IndexError("Index out of range")
-        return self.positions[item]
+    def progressed(self, current, total):
+        self.progress.setValue(current)
 
-    def __len__(self):
-        return len(self.positions)
+    def failed(self, error):
+        self.infoLabel.setText("%s %s" % (self.strings.MIT_Failed, error))
 
-    def add(self, item):
-        if not isinstance(item, PanoramaPosition):
-            raise ValueError("Panoramas can only contain PanoramaPositions")
-        self.positions.append(item)
-        self.sort()
-
-    def remove(self, item):
-        if item in self.positions:
-            self.positions.remove(item)
+    def workerFinished(self):
+        if self.closeWhenStopped:
+            super(CapturePanorama, self).reject()
+            return
+        if self.worker.completed:
+            text = "%s\n\n%s\n%s" % (self.strings.MIT_Done, self.strings.MIT_StageTimes, self.engine.timings)
+            if self.skipped:
+                text += "\n\n%s %d" % (self.strings.MIT_Skipped, self.skipped)
+            if self.engine.exposure is not None and self.engine.exposure.warmStarts:
+                summary = self.engine.exposure.summary()
+                text += "\n\n" + self.strings.MIT_WarmStarts % (summary["warmStarts"], summary["estimatedSaved"])
+            self.infoLabel.setText(text)
+            self.progress.setValue(self.progress.maximum())
+        elif self.engine.isCancelled():
+            self.infoLabel.setText(self.strings.MIT_Cancelled)
+        self.cancel.setText(self.strings.MIT_Close)
 
-    def getIndex(self, item):
-        if item in self.positions:
-            return self.positions.index(item)
-        else:
-            return -1
-
-    def __str__(self):
-        string = ""
-        for position in self.positions:
-            string += "%s\n" % str(position)
-        return string
-
-    def sort(self):
-        # We need to make sure we put the least strain on the PTU as possible,
-        # so we order the positions from top left to bottom right
-        self.positions.sort(reverse=True, key=lambda pos: pos.pan)
-        self.positions.sort(reverse=True, key=lambda pos: pos.tilt)
-
-class PanoramaPosition(QListWidgetItem):
-
-    def __init__(self, pan, tilt, name):
-        super(PanoramaPosition, self).__init__()
-        self.pan = pan
-        self.tilt = tilt
-        self.name = name
-        self.captures = []
-        self.updateText()
-
-    def updateText(self):
-        self.setText(str(self))
-
-    def __lt__(self, other):
-        return self.pan > other.pan and self.tilt >= other.tilt
-
-    def __str__(self):
-        if self.name:
-            return self.name
-        else:
-            return "(%.1f,%.1f)" % (self.pan, self.tilt)
-
-    def __eq__(self, other):
-        return self.pan == other.pan and self.tilt == other.tilt
-
-class Capture(QListWidgetItem):
-
-    def __init__(self, name, camera=0, filter=0, gain=0.0, shutter=0.0,
-                 shutter_target=0.0, roix=0, roiy=0, roiw=0, roih=0, aeMode=0,
-                 aeAlg=0, aeTarget=0.0, aeTol=0.0, aeMax=0.0, aeMin=0.0, aeRate=0.0, aeOutliers=0.0):
-        super(Capture, self).__init__()
-        self.name = name
-        self.camera = camera
-        self.filter = filter
-        self.gain = gain
-        self.shutter = shutter
-        self.shutter_target = shutter_target
-        self.roi = (roix, roiy, roiw, roih)
-        self.aeMode = aeMode
-        self.aeAlg = aeAlg
-        self.aeTarget = aeTarget
-        self.aeTol = aeTol
-        self.aeMax = aeMax
-        self.aeMin = aeMin
-        self.aeRate = aeRate
-        self.aeOutliers = aeOutliers
-
-        self.updateText()
-
-    def updateText(self):
-        self.setText(str(self))
-
-    def __str__(self):
-        return self.name
-
-    def __eq__(self, other):
-        return self.name == other.name
+    def reject(self):
+        # Don't leave the worker running behind a closed dialog, ask it to
+        # stop and close once it has
+        if self.worker.isRunning():
+            self.engine.cancel()
+            self.closeWhenStopped = True
+            self.infoLabel.setText(self.strings.MIT_Cancelling)
+            self.cancel.setEnabled(False)
+            return
+        super(CapturePanorama, self).reject()
+
+class CaptureThread(QThread):
+    # Signals carry the text of each item, the items themselves belong to the GUI thread
+    positionStarted = pyqtSignal(str)
+    captureStarted = pyqtSignal(str)
+    captureFinished = pyqtSignal(str)
+    captureSkipped = pyqtSignal(str)
+    progressed = pyqtSignal(int, int)
+    failed = pyqtSignal(str)
+
+    def __init__(self, engine):
+        super(CaptureThread, self).__init__()
+        self.engine = engine
+        self.engine.listener = CaptureThreadListener(self)
+        self.completed = False
+
+    def run(self):
+        try:
+            self.completed = self.engine.run()
+        except Exception as error:
+            self.completed = False
+            self.failed.emit(str(error))
+
+class CaptureThreadListener(CaptureListener):
+
+    def __init__(self, thread):
+        super(CaptureThreadListener, self).__init__()
+        self.thread = thread
+
+    def positionStarted(self, position):
+        self.thread.positionStarted.emit(str(position))
+
+    def captureStarted(self, position, capture):
+        self.thread.captureStarted.emit(str(capture))
+
+    def captureFinished(self, position, capture, fileName):
+        self.thread.captureFinished.emit(fileName)
+
+    def captureSkipped(self, position, capture, fileName):
+        self.thread.captureSkipped.emit(str(capture))
+
+    def progress(self, current, total):
+        self.thread.progressed.emit(current, total)
@@ -4,7 +4,12 @@
 from PyQt5.QtWidgets import *
 from PyQt5.QtCore import *
 from PyQt5.QtGui import *
-from PIL.ImageQt import ImageQt
+from lib.cameraCache import cameraShadows
+from lib.preview import PreviewRenderer, thumbnail
+from lib.ptuControl import JogController, ptuState
+from lib.tracing import tracer
+import threading
+import time
 
 class Tab(QWidget):
 
@@ -15,6 +20,24 @@ class Tab(QWidget):
         self.strings = strings
         self.api = api
         self.title = self.strings.PTT_Title
+        # Thumbnails are made off the GUI thread
+        self.previews = PreviewRenderer()
+
+        # Frames are pulled and shrunk on their own thread while live view is on
+        self.liveView = LiveViewThread(self.api, self.config.PTT_LiveViewFps, self.verbose)
+        self.liveView.frameReady.connect(self.showLiveFrame)
+        QCoreApplication.instance().aboutToQuit.connect(self.liveView.stop)
+        self.liveFps = None
+        self.lastLiveFrame = None
+
+        # Jogs are added up and sent as one move once the clicking stops
+        # The PTU values shown come from the shared state, which polls in the background
+        self.ptuState = ptuState(self.api, self.config.ptu_poll_rate)
+        self.ptuState.changed.connect(self.showPTUVals)
+        QCoreApplication.instance().aboutToQuit.connect(self.ptuState.stop)
+        self.jog = JogController(self.ptuState, self.config.PTT_JogDebounceMs / 1000.0)
+        self.jog.settled.connect(self.ptuSettled)
+        self.jog.failed.connect(self.ptuFailed)
 
         self.initTab()
 
@@ -148,7 +171,7 @@ class Tab(QWidget):
 
         self.currentVal = QLabel()
         self.refreshButton = QPushButton()
-        self.refreshButton.clicked.connect(self.updatePTUVals)
+        self.refreshButton.clicked.connect(self.ptuState.requestPoll)
         self.refreshButton.setIcon(QIcon(refreshBase))
 
         leftValLayout = QHBoxLayout()
@@ -174,6 +197,10 @@ class Tab(QWidget):
         self.refreshCheckbox = QCheckBox(self.strings.PTT_AutoRefresh)
         self.refreshCombo = QComboBox()
         self.refreshCombo.addItems(self.config.cameras)
+        self.refreshCombo.currentIndexChanged.connect(self.liveView.setCamera)
+        self.liveCheckbox = QCheckBox(self.strings.PTT_LiveView)
+        self.liveCheckbox.toggled.connect(self.toggleLiveView)
+        self.liveStats = QLabel()
 
         refreshPreviewLayout = QHBoxLayout()
         refreshPreviewLayout.addWidget(self.refreshPreview)
@@ -181,8 +208,14 @@ class Tab(QWidget):
         refreshPreviewLayout.addStretch()
         refreshPreviewLayout.addWidget(self.refreshCheckbox)
 
+        liveViewLayout = QHBoxLayout()
+        liveViewLayout.addWidget(self.liveCheckbox)
+        liveViewLayout.addStretch()
+        liveViewLayout.addWidget(self.liveStats)
+
         previewLayout.addWidget(self.preview)
         previewLayout.addLayout(refreshPreviewLayout)
+        previewLayout.addLayout(liveViewLayout)
 
         previewGroup = QGroupBox(self.strings.PTT_PreviewTitle)
         previewGroup.setLayout(previewLayout)
@@ -206,73 +239,197 @@ class Tab(QWidget):
 
         self.setLayout(layout)
 
-        self.updatePTUVals()
+        self.showPTUVals()
+        self.ptuState.requestPoll()
+
+    # Moves are sent by the jog controller, the values and preview are
+    # updated when it says the PTU has settled
 
     def setPan(self):
-        ptu = self.api.pancam.ptu
-        ptu.pan = float(self.pan.text())
-        self.updatePTUVals()
+        self.jog.moveTo(pan=float(self.pan.text()))
 
     def setTilt(self):
-        ptu = self.api.pancam.ptu
-        ptu.tilt = float(self.tilt.text())
-        self.updatePTUVals()
+        self.jog.moveTo(tilt=float(self.tilt.text()))
 
     def home(self):
-        ptu = self.api.pancam.ptu
-        ptu.stow()
-        self.updatePTUVals()
+        self.jog.stow()
 
     def adjustLeft(self):
         self.adjustPan(1)
-        self.updatePTUVals()
 
     def adjustUp(self):
         self.adjustTilt(1)
-        self.updatePTUVals()
 
     def adjustRight(self):
         self.adjustPan(-1)
-        self.updatePTUVals()
 
     def adjustDown(self):
         self.adjustTilt(-1)
-        self.updatePTUVals()
 
     def adjustLargeLeft(self):
         self.adjustPan(float(self.largeAdjustVal.text()))
-        self.updatePTUVals()
 
     def adjustLargeUp(self):
         self.adjustTilt(float(self.largeAdjustVal.text()))
-        self.updatePTUVals()
 
     def adjustLargeRight(self):
         self.adjustPan(float(self.largeAdjustVal.text()) * -1)
-        self.updatePTUVals()
 
     def adjustLargeDown(self):
         self.adjustTilt(float(self.largeAdjustVal.text()) * -1)
-        self.updatePTUVals()
 
     def adjustPan(self, val):
-        self.api.pancam.ptu.pan += val
+        self.jog.jog(pan=val)
 
     def adjustTilt(self, val):
-        self.api.pancam.ptu.tilt += val
-
-    def updatePTUVals(self):
-        self.currentVal.setText("%s:\t%.3f\n%s:\t%.3f" % (self.strings.PTT_Pan, self.api.pancam.ptu.pan,
-                                                self.strings.PTT_Tilt, self.api.pancam.ptu.tilt))
-        if self.refreshCheckbox.isChecked():
+        self.jog.jog(tilt=val)
+
+    def ptuFailed(self, error):
+        message = QMessageBox()
+        message.setText(error)
+        message.exec()
+
+    def showPTUVals(self):
+        (pan, tilt) = self.ptuState.position()
+        if pan is None or tilt is None:
+            return
+        self.currentVal.setText("%s:\t%.3f\n%s:\t%.3f" % (self.strings.PTT_Pan, pan,
+                                                self.strings.PTT_Tilt, tilt))
+
+    def ptuSettled(self):
+        self.showPTUVals()
+        # Live view is already keeping the preview up to date
+        if self.refreshCheckbox.isChecked() and not self.liveCheckbox.isChecked():
             self.updatePreview()
 
     def updatePreview(self):
         cameraNumber = self.refreshCombo.currentIndex()
-        camera = self.api.pancam.cameras[cameraNumber]
-        self.image = camera.get_image()
-        pixmap = QPixmap.fromImage(ImageQt(self.image.as_pil_image()).scaled(self.preview.size(), Qt.KeepAspectRatio))
-        self.preview.setPixmap(pixmap)
+        camera = cameraShadows(self.api)[cameraNumber]
+        with tracer.span("frame", camera=cameraNumber, preview=True):
+            self.image = camera.get_image()
+            self.previews.show(self.image, self.preview)
+
+    def toggleLiveView(self, checked):
+        self.refreshPreview.setEnabled(not checked)
+        if checked:
+            self.liveFps = None
+            self.lastLiveFrame = None
+            self.liveView.setCamera(self.refreshCombo.currentIndex())
+            self.liveView.setSize(self.preview.width(), self.preview.height())
+            self.liveView.setPaused(not self.isVisible())
+            if not self.liveView.isRunning():
+                self.liveView.start()
+        else:
+            self.liveView.stop()
+            self.liveStats.setText("")
+
+    def showLiveFrame(self):
+        frame = self.liveView.takeFrame()
+        # Live view was turned off while this frame was on its way
+        if frame is None or not self.liveCheckbox.isChecked():
+            return
+        (qimage, started) = frame
+        self.preview.setPixmap(QPixmap.fromImage(qimage))
+        # Measured on what is actually shown, so dropped frames don't count
+        now = time.perf_counter()
+        latency = now - started
+        if self.lastLiveFrame:
+            # Smoothed so the display doesn't flicker between values
+            fps = 1.0 / max(now - self.lastLiveFrame, 1e-6)
+            self.liveFps = fps if self.liveFps is None else 0.8 * self.liveFps + 0.2 * fps
+        self.lastLiveFrame = now
+        self.liveStats.setText(self.strings.PTT_LiveStats % (self.liveFps or 0.0, latency * 1000))
+
+    def showEvent(self, event):
+        # Other tabs may have moved the PTU while we were hidden
+        self.jog.reset()
+        # The PTU is only polled while its values are on screen
+        self.ptuState.start()
+        self.ptuState.requestPoll()
+        # Only stream while someone can see it, captures on other tabs come first
+        self.liveView.setPaused(False)
+        self.liveView.setSize(self.preview.width(), self.preview.height())
+        super(Tab, self).showEvent(event)
+
+    def hideEvent(self, event):
+        self.liveView.setPaused(True)
+        # Don't hold the tab switch up for a poll that's under way
+        self.ptuState.stop(wait=False)
+        super(Tab, self).hideEvent(event)
+
+class LiveViewThread(QThread):
+    """
+    Pulls frames from one camera as fast as the target frame rate allows and
+    shrinks them to the preview size. Only the newest frame is kept, if the
+    GUI hasn't taken the last one by the time the next is ready the old one is
+    thrown away rather than queued.
+    """
+
+    frameReady = pyqtSignal()
+
+    def __init__(self, api, frameRate, verbose=False):
+        super(LiveViewThread, self).__init__()
+        self.api = api
+        self.verbose = verbose
+        self.period = 1.0 / max(float(frameRate), 0.1)
+        self.camera = 0
+        self.size = (300, 300)
+        self.frame = None
+        self._lock = threading.Lock()
+        self._running = threading.Event()
+        self._stopping = threading.Event()
+
+    def setCamera(self, camera):
+        self.camera = camera
+
+    def setSize(self, width, height):
+        self.size = (max(1, width), max(1, height))
+
+    def setPaused(self, paused):
+        if paused:
+            self._running.clear()
+        else:
+            self._running.set()
+
+    def stop(self):
+        self._stopping.set()
+        self._running.set()
+        self.wait()
+        self._stopping.clear()
+        self._running.clear()
+        self.frame = None
+
+    def takeFrame(self):
+        with self._lock:
+            (frame, self.frame) = (self.frame, None)
+        return frame
+
+    def run(self):
+        while not self._stopping.is_set():
+            self._running.wait()
+            if self._stopping.is_set():
+                return
+            started = time.perf_counter()
+            try:
+                camera = cameraShadows(self.api)[self.camera]
+                with tracer.span("liveview.frame", camera=self.camera):
+                    qimage = thumbnail(camera.get_image().as_pil_image(), self.size)
+            except Exception as error:
+                # Probably busy with something else, try again next period
+                if self.verbose:
+                    print("Live view: %s" % error)
+                qimage = None
+            if qimage is not None:
+                with self._lock:
+                    # An untaken frame is stale now, replace it
+                    waiting = self.frame is not None
+                    self.frame = (qimage, started)
+                if not waiting:
+                    self.frameReady.emit()
+            # Hold the target rate, but never sleep if we are already behind
+            remaining = self.period - (time.perf_counter() - started)
+            if remaining > 0:
+                self._stopping.wait(remaining)
 
 class SquareButton(QToolButton):
 
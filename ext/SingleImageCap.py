@@ -4,7 +4,11 @@
 from PyQt5.QtWidgets import *
 from PyQt5.QtGui import *
 from PyQt5.QtCore import *
-from PIL.ImageQt import ImageQt
+from lib.cameraCache import cameraShadows
+from lib.preview import PreviewRenderer
+from lib.imageStats import StatsRunner, HistogramPanel
+from lib.tracing import tracer
+from lib.rawFrames import writeRaw
 import os
 
 class Tab(QWidget):
@@ -21,9 +25,14 @@ class Tab(QWidget):
         self.LWACimage = None
         self.RWACimage = None
         self.HRCimage = None
-        self.LWACcamera = self.api.pancam.cameras[0]
-        self.RWACcamera = self.api.pancam.cameras[1]
-        self.HRCcamera = self.api.pancam.cameras[2]
+        # Shadows only send settings the cameras don't already have
+        cameras = cameraShadows(self.api)
+        self.LWACcamera = cameras[0]
+        self.RWACcamera = cameras[1]
+        self.HRCcamera = cameras[2]
+        # Thumbnails and statistics are made off the GUI thread
+        self.previews = PreviewRenderer()
+        self.stats = StatsRunner()
 
         # == LWAC ==
         self.LWACcaptureButton = QPushButton(self.strings.SIT_LWACcap)
@@ -35,6 +44,7 @@ class Tab(QWidget):
 
         self.LWACpreview = SquareLabel()
         self.LWACpreview.setStyleSheet("border: 1px solid black; padding: 2px")
+        self.LWAChistogram = HistogramPanel(self.strings.SIT_Stats)
 
         self.LWACScroll = QScrollArea()
         self.LWACScroll.setWidgetResizable(True)
@@ -113,6 +123,7 @@ class Tab(QWidget):
 
         self.HRCpreview = SquareLabel()
         self.HRCpreview.setStyleSheet("border: 1px solid black; padding: 2px")
+        self.HRChistogram = HistogramPanel(self.strings.SIT_Stats)
 
         self.HRCScroll = QScrollArea()
         self.HRCScroll.setWidgetResizable(True)
@@ -182,6 +193,7 @@ class Tab(QWidget):
 
         self.RWACpreview = SquareLabel()
         self.RWACpreview.setStyleSheet("border: 1px solid black; padding: 2px")
+        self.RWAChistogram = HistogramPanel(self.strings.SIT_Stats)
 
         self.RWACScroll = QScrollArea()
         self.RWACScroll.setWidgetResizable(True)
@@ -292,6 +304,7 @@ class Tab(QWidget):
         self.LWACScroll.setWidget(self.LWACScrollHolder)
 
         LWACLayout.addWidget(self.LWACpreview)
+        LWACLayout.addWidget(self.LWAChistogram)
         LWACLayout.addWidget(self.LWACScroll, stretch=1)
         LWACLayout.addWidget(self.LWACcaptureButton)
         LWACLayout.addWidget(self.LWACsaveButton)
@@ -338,6 +351,7 @@ class Tab(QWidget):
         self.RWACScroll.setWidget(self.RWACScrollHolder)
 
         RWACLayout.addWidget(self.RWACpreview)
+        RWACLayout.addWidget(self.RWAChistogram)
         RWACLayout.addWidget(self.RWACScroll, stretch=1)
         RWACLayout.addWidget(self.RWACcaptureButton)
         RWACLayout.addWidget(self.RWACsaveButton)
@@ -384,6 +398,7 @@ class Tab(QWidget):
         self.HRCScroll.setWidget(self.HRCScrollHolder)
 
         HRCLayout.addWidget(self.HRCpreview)
+        HRCLayout.addWidget(self.HRChistogram)
         HRCLayout.addWidget(self.HRCScroll, stretch=1)
         HRCLayout.addWidget(self.HRCcaptureButton)
         HRCLayout.addWidget(self.HRCsaveButton)
@@ -397,6 +412,7 @@ class Tab(QWidget):
         self.setLayout(layout)
 
     def LWACcapture(self):
+        start = tracer.now()
         self.LWACcamera.filter = self.LWACFilterCombo.currentIndex()
         self.LWACcamera.gain = int(self.LWACGain.text())
         self.LWACcamera.shutter = float(self.LWACShutter.text())
@@ -423,7 +439,7 @@ class Tab(QWidget):
             serverAE = False
             self.LWACcamera.shutter_mode = 1
 
-        #self.LWACcamera.ae_algorithm = int(self.LWACAeAlg.text())
+        self.LWACcamera.ae_algorithm = self.LWACAeAlg.currentIndex()
         self.LWACcamera.ae_target = float(self.LWACAeTarget.text())
         self.LWACcamera.ae_tolerance = float(self.LWACAeTol.text())
         self.LWACcamera.ae_max_shutter = float(self.LWACAeMax.text())
@@ -432,11 +448,13 @@ class Tab(QWidget):
         self.LWACcamera.ae_outliers = float(self.LWACAeOutliers.text())
 
         self.LWACimage = self.LWACcamera.get_image(ae=serverAE)
-        pixmap = QPixmap.fromImage(ImageQt(self.LWACimage.as_pil_image()).scaled(self.LWACpreview.size(), Qt.KeepAspectRatio))
-        self.LWACpreview.setPixmap(pixmap)
+        self.previews.show(self.LWACimage, self.LWACpreview)
+        self.stats.show(self.LWACimage, self.LWAChistogram, float(self.LWACAeOutliers.text() or 0))
         self.LWACsaveButton.setEnabled(True)
+        tracer.record("frame", start, tracer.now(), dict(camera="LWAC"))
 
     def RWACcapture(self):
+        start = tracer.now()
         self.RWACcamera.filter = self.RWACFilterCombo.currentIndex()
         self.RWACcamera.gain = int(self.RWACGain.text())
         self.RWACcamera.shutter = float(self.RWACShutter.text())
@@ -472,11 +490,13 @@ class Tab(QWidget):
         self.RWACcamera.ae_outliers = float(self.RWACAeOutliers.text())
 
         self.RWACimage = self.RWACcamera.get_image(ae=serverAE)
-        pixmap = QPixmap.fromImage(ImageQt(self.RWACimage.as_pil_image()).scaled(self.RWACpreview.size(), Qt.KeepAspectRatio))
-        self.RWACpreview.setPixmap(pixmap)
+        self.previews.show(self.RWACimage, self.RWACpreview)
+        self.stats.show(self.RWACimage, self.RWAChistogram, float(self.RWACAeOutliers.text() or 0))
         self.RWACsaveButton.setEnabled(True)
+        tracer.record("frame", start, tracer.now(), dict(camera="RWAC"))
 
     def HRCcapture(self):
+        start = tracer.now()
         self.HRCcamera.gain = int(self.HRCGain.text())
         self.HRCcamera.shutter = float(self.HRCShutter.text())
         self.HRCcamera.shutter_target = float(self.HRCExposure.text())
@@ -502,7 +522,7 @@ class Tab(QWidget):
           serverAE = False
           self.HRCcamera.shutter_mode = 1
 
-        #self.HRCcamera.ae_algorithm = int(self.HRCAeAlg.text())
+        self.HRCcamera.ae_algorithm = self.HRCAeAlg.currentIndex()
         self.HRCcamera.ae_target = float(self.HRCAeTarget.text())
         self.HRCcamera.ae_tolerance = float(self.HRCAeTol.text())
         self.HRCcamera.ae_max_shutter = float(self.HRCAeMax.text())
@@ -511,27 +531,40 @@ class Tab(QWidget):
         self.HRCcamera.ae_outliers = float(self.HRCAeOutliers.text())
 
         self.HRCimage = self.HRCcamera.get_image(ae=serverAE)
-        pixmap = QPixmap.fromImage(ImageQt(self.HRCimage.as_pil_image()).scaled(self.HRCpreview.size(), Qt.KeepAspectRatio))
-        self.HRCpreview.setPixmap(pixmap)
+        self.previews.show(self.HRCimage, self.HRCpreview)
+        self.stats.show(self.HRCimage, self.HRChistogram, float(self.HRCAeOutliers.text() or 0))
         self.HRCsaveButton.setEnabled(True)
+        tracer.record("frame", start, tracer.now(), dict(camera="HRC"))
 
     def LWACsave(self):
         if self.LWACimage:
-            file = QFileDialog.getSaveFileName(self, self.strings.SIT_SaveImage, os.path.expanduser("~"), "%s (*.png)" % self.strings.SIT_Images)
-            if file[0]:
-                self.LWACimage.save_png_with_metadata(file[0])
+            self.saveImage(self.LWACimage, "LWAC")
 
     def RWACsave(self):
         if self.RWACimage:
-            file = QFileDialog.getSaveFileName(self, self.strings.SIT_SaveImage, os.path.expanduser("~"), "%s (*.png)" % self.strings.SIT_Images)
-            if file[0]:
-                self.RWACimage.save_png_with_metadata(file[0])
+            self.saveImage(self.RWACimage, "RWAC")
 
     def HRCsave(self):
         if self.HRCimage:
-            file = QFileDialog.getSaveFileName(self, self.strings.SIT_SaveImage, os.path.expanduser("~"), "%s (*.png)" % self.strings.SIT_Images)
-            if file[0]:
-                self.HRCimage.save_png_with_metadata(file[0])
+            self.saveImage(self.HRCimage, "HRC")
+
+    def saveImage(self, image, camera):
+        # Raw skips the PNG compression, ace-ng convert makes the PNG later
+        file = QFileDialog.getSaveFileName(self, self.strings.SIT_SaveImage, os.path.expanduser("~"),
+                                           "%s (*.png);;%s (*.raw)" % (self.strings.SIT_Images, self.strings.SIT_RawImages))
+        fileName = file[0]
+        if fileName:
+            raw = fileName.endswith(".raw") or file[1].endswith("(*.raw)")
+            # The dialog doesn't add the extension, and ace-ng convert only
+            # looks for .raw files
+            extension = ".raw" if raw else ".png"
+            if not fileName.endswith(extension):
+                fileName += extension
+            with tracer.span("image.save", camera=camera, file=fileName):
+                if raw:
+                    writeRaw(image, fileName)
+                else:
+                    image.save_png_with_metadata(fileName)
 
     def updateLWACAeMode(self):
         if self.LWACAeModeServer.isChecked():
@@ -13,4 +13,6 @@ class Tab(QWidget):
         self.config = config
         self.strings = strings
         self.api = api
+        # Also add the module and this title's language property to
+        # ext/manifest.json, so the tab is only built when first shown
         self.title = ""
@@ -0,0 +1,161 @@
+# -- autoExposure.py - Client side auto exposure for ace-ng --
+# Author:     Owen Tourlamain
+# Supervisor: Dr. Laurence Tyler
+
+import numpy
+
+class ClientAE(object):
+    """
+    autoExposure.py
+
+    Auto exposure run by ace-ng rather than the server or the camera, using
+    the same settings. Each frame is measured with one of the AeAlgs:
+
+        Mean    the average level, ignoring the brightest outliers fraction
+        Range   the level of the brightest pixels, ignoring the outliers
+                fraction of them, so highlights sit at the target
+
+    and the shutter is moved adjustRate of the way towards the one that
+    would put the level on target, within minShutter and maxShutter, until
+    the level is within tolerance. The frame that gets there is the capture,
+    so no exposure is taken just to be thrown away once the AE has settled.
+
+    Frames are measured over the ROI if there is one, or the middle window
+    fraction of each side of the frame if not, and only on every step'th
+    pixel in each direction, as the statistics hardly change and a full frame
+    takes much longer to go through. With a MeteringReadout only the first
+    frame has to come over whole, see below.
+
+        from lib.autoExposure import aeFromCapture
+        (image, shutter, iterations) = aeFromCapture(capture).converge(camera, capture.shutter)
+    """
+
+    MEAN = 0
+    RANGE = 1
+
+    def __init__(self, algorithm=MEAN, target=0.5, tolerance=0.05, outliers=0.01, minShutter=0.1,
+                 maxShutter=1000.0, adjustRate=0.5, roi=None, step=4, maxIterations=20, window=1.0):
+        self.algorithm = algorithm
+        self.target = target
+        self.tolerance = tolerance
+        self.outliers = min(max(outliers, 0.0), 0.5)
+        self.minShutter = minShutter
+        self.maxShutter = maxShutter
+        self.adjustRate = adjustRate
+        self.roi = roi if roi and roi[2] and roi[3] else None
+        self.step = max(1, int(step))
+        self.maxIterations = maxIterations
+        self.window = min(max(window, 0.0), 1.0)
+
+    def meteringRegion(self, size):
+        # The ROI, or the middle of a frame of size if there isn't one
+        if self.roi or self.window >= 1:
+            return self.roi
+        (width, height) = (max(1, int(size[0] * self.window)), max(1, int(size[1] * self.window)))
+        return ((size[0] - width) // 2, (size[1] - height) // 2, width, height)
+
+    def pixels(self, image):
+        # The pixels to measure, as levels between 0 and 1
+        pixels = numpy.asarray(image.as_pil_image())
+        if self.roi:
+            (x, y, width, height) = self.roi
+            # A camera reading out only the metering region has cropped it already
+            if pixels.shape[:2] != (height, width):
+                pixels = pixels[y:y + height, x:x + width]
+        # A strided view, nothing is copied until the levels are worked out
+        pixels = pixels[::self.step, ::self.step]
+        full = numpy.iinfo(pixels.dtype).max if pixels.dtype.kind in "ui" else 1.0
+        return pixels.ravel() / float(full)
+
+    def measure(self, image):
+        levels = self.pixels(image)
+        if not levels.size:
+            raise ValueError("No pixels to measure in the ROI")
+        # Everything above the outliers is in the last part after partitioning
+        top = int((1.0 - self.outliers) * (levels.size - 1))
+        levels = numpy.partition(levels, top)
+        if self.algorithm == self.RANGE:
+            return float(levels[top])
+        return float(levels[:top + 1].mean())
+
+    def nextShutter(self, shutter, level):
+        if level >= 0.99:
+            # Saturated, the level says nothing about how far over we are
+            wanted = shutter / 2.0
+        else:
+            wanted = shutter * self.target / max(level, 1e-3)
+        shutter += (wanted - shutter) * self.adjustRate
+        return min(max(shutter, self.minShutter), self.maxShutter)
+
+    def isSettled(self, shutter, level):
+        if abs(level - self.target) <= self.tolerance:
+            return True
+        # Nothing more we can do if the shutter is already at its limit
+        return (level < self.target and shutter >= self.maxShutter) or \
+               (level > self.target and shutter <= self.minShutter)
+
+    def converge(self, camera, shutter, readout=None):
+        # Returns (image, shutter, iterations), image being the last frame
+        # taken. readout(camera) takes each frame, get_image() if not given
+        readout = readout if readout else (lambda camera: camera.get_image())
+        shutter = min(max(shutter or self.minShutter, self.minShutter), self.maxShutter)
+        iterations = 0
+        while True:
+            camera.shutter = shutter
+            image = readout(camera)
+            iterations += 1
+            if iterations == 1:
+                # Every later frame is measured over the same part of the scene
+                self.roi = self.meteringRegion(image.as_pil_image().size)
+            level = self.measure(image)
+            if iterations >= self.maxIterations or self.isSettled(shutter, level):
+                return (image, shutter, iterations)
+            shutter = self.nextShutter(shutter, level)
+
+class MeteringReadout(object):
+    """
+    Takes the frames for ClientAE.converge(). The first comes over whole, as
+    when the AE has nothing to do it is the capture. After that the camera is
+    told to meter over the AE's region, so a camera that reads out only its
+    metering region doesn't send the whole sensor for every iteration.
+    finish() puts the camera's own region back and gives the frame to keep,
+    taking one more whole frame at the settled shutter if the last one was
+    only part of the sensor.
+
+        readout = MeteringReadout(ae)
+        (image, shutter, iterations) = ae.converge(camera, shutter, readout)
+        image = readout.finish(camera, image)
+    """
+
+    def __init__(self, ae):
+        self.ae = ae
+        self.size = None
+        # The camera's own (roi, ae_meter_region), while we've changed them
+        self.saved = None
+
+    def __call__(self, camera):
+        if self.size is not None and self.saved is None and self.ae.roi:
+            self.saved = (camera.roi, camera.ae_meter_region)
+            camera.roi = self.ae.roi
+            camera.ae_meter_region = 1
+        image = camera.get_image()
+        if self.size is None:
+            self.size = image.as_pil_image().size
+        return image
+
+    def restore(self, camera):
+        if self.saved is not None:
+            (camera.roi, camera.ae_meter_region) = self.saved
+            self.saved = None
+
+    def finish(self, camera, image):
+        self.restore(camera)
+        if image.as_pil_image().size != self.size:
+            image = camera.get_image()
+        return image
+
+def aeFromCapture(capture, step=4, window=1.0):
+    # The capture's AE settings, with the server's defaults for anything unset
+    return ClientAE(capture.aeAlg, capture.aeTarget or 0.5, capture.aeTol or 0.05, capture.aeOutliers,
+                    capture.aeMin or 0.1, capture.aeMax or 1000.0, capture.aeRate or 0.5,
+                    capture.roi, step, window=window)
@@ -0,0 +1,92 @@
+# -- cameraCache.py - Client side camera settings cache for ace-ng --
+# Author:     Owen Tourlamain
+# Supervisor: Dr. Laurence Tyler
+
+from lib.tracing import tracer
+
+class CameraShadow(object):
+    """
+    cameraCache.py
+
+    Wraps a pancam_api camera and remembers the last value written to each
+    attribute, so writing the same value again doesn't cost a round trip to
+    the server. Reads and everything else are passed straight through.
+
+    Every user of a camera has to go through the same shadow, or the shadow
+    won't know about their changes, so get them from cameraShadows().
+
+        from lib.cameraCache import cameraShadows
+        camera = cameraShadows(api)[0]
+        camera.gain = 2     # sent
+        camera.gain = 2     # skipped
+        camera.invalidate() # after a reconnect, next write is sent again
+    """
+
+    # Attributes the server may change itself when it runs auto exposure
+    AE_ATTRIBUTES = ("shutter",)
+
+    def __init__(self, camera, number=None):
+        # Our own attributes have to bypass __setattr__
+        object.__setattr__(self, "_camera", camera)
+        object.__setattr__(self, "_number", number)
+        object.__setattr__(self, "_known", {})
+        object.__setattr__(self, "sent", 0)
+        object.__setattr__(self, "skipped", 0)
+
+    def __getattr__(self, name):
+        # Only called for attributes we don't have, so reads go to the camera
+        return getattr(self._camera, name)
+
+    def __setattr__(self, name, value):
+        known = self._known
+        if name in known and known[name] == value:
+            object.__setattr__(self, "skipped", self.skipped + 1)
+            return
+        try:
+            with tracer.span("camera.set", camera=self._number, attribute=name, value=value):
+                setattr(self._camera, name, value)
+        except Exception:
+            # We no longer know what the camera has
+            known.pop(name, None)
+            raise
+        known[name] = value
+        object.__setattr__(self, "sent", self.sent + 1)
+
+    def get_image(self, *args, **kwargs):
+        try:
+            with tracer.span("camera.get_image", camera=self._number, ae=bool(kwargs.get("ae"))):
+                image = self._camera.get_image(*args, **kwargs)
+        except Exception:
+            self.invalidate()
+            raise
+        # With auto exposure the camera or the server picks the shutter
+        if kwargs.get("ae") or self._known.get("shutter_mode") == 1:
+            self.invalidate(*self.AE_ATTRIBUTES)
+        return image
+
+    def invalidate(self, *names):
+        # Forget the given attributes, or everything if none are given
+        if names:
+            for name in names:
+                self._known.pop(name, None)
+        else:
+            self._known.clear()
+
+# One set of shadows per API, shared by everything that uses the cameras
+_shadows = {}
+
+def cameraShadows(api):
+    key = id(api.pancam)
+    shadows = _shadows.get(key)
+    cameras = list(api.pancam.cameras)
+    # setup_cameras() may have replaced the cameras since we last looked
+    if shadows is None or len(shadows) != len(cameras) or \
+            any(shadow._camera is not camera for (shadow, camera) in zip(shadows, cameras)):
+        shadows = [CameraShadow(camera, number) for (number, camera) in enumerate(cameras)]
+        _shadows[key] = shadows
+    return shadows
+
+def invalidateCameras(api):
+    # Call after reconnecting or when the camera state is otherwise unknown
+    for shadow in cameraShadows(api):
+        shadow.invalidate()
@@ -0,0 +1,444 @@
+# -- captureEngine.py - Panorama capture engine for ace-ng --
+# Author:     Owen Tourlamain
+# Supervisor: Dr. Laurence Tyler
+
+import os
+import queue
+import concurrent.futures
+from lib.cameraCache import cameraShadows, invalidateCameras
+from lib.captureOrder import CaptureOrderer
+from lib.captureJournal import CaptureJournal
+from lib.rawFrames import writeRaw, headerName
+from lib.frameContainer import FrameContainer, encodeFrame
+from lib.exposureMemory import ExposureMemory
+from lib.autoExposure import aeFromCapture, MeteringReadout
+from lib.ptuControl import ptuState
+from lib.stageTimings import StageTimings
+from lib.tracing import tracer
+import threading
+
+class CaptureEngine(object):
+    """
+    captureEngine.py
+
+    Runs the position/capture loop of a panorama without touching the GUI, so
+    it can be driven from a worker thread. Progress is reported to a
+    CaptureListener, and the run can be cancelled from any thread between any
+    two operations.
+
+    Captured frames are handed to a FrameWriter, so the PTU can move on to the
+    next position while earlier frames are still being encoded and written.
+    With parallelCameras set, captures for different cameras at the same
+    position are taken at the same time. A CaptureOrderer can be given to
+    reorder the captures at each position, file names don't depend on order.
+    With a CaptureJournal every finished capture is recorded, and a resumed
+    run skips the ones already done. outputFormat "raw" writes the sensor data
+    without compressing it, see rawFrames.py. With container set every frame
+    goes into one FrameContainer file in path instead of a file each. With an
+    ExposureMemory, captures using server or client AE start from the shutter
+    a nearby position settled on rather than their own. Client AE is run
+    here, see autoExposure.py, measuring every aeStep'th pixel of the ROI or
+    the middle aeWindow of the frame, and reading out only that after the
+    first frame if the camera can.
+
+        from lib.captureEngine import CaptureEngine
+        engine = CaptureEngine(api, panorama, "/data/pan1")
+        engine.run()
+        print(engine.timings)
+    """
+
+    def __init__(self, api, panorama, path, listener=None, writerThreads=2, queueSize=4,
+                 parallelCameras=False, captureOrderer=None, journal=None, resume=False,
+                 outputFormat="png", container=False, exposure=None, aeStep=4,
+                 aeWindow=1.0):
+        self.api = api
+        self.panorama = panorama
+        self.path = path
+        self.listener = listener if listener else CaptureListener()
+        self.writerThreads = writerThreads
+        self.queueSize = queueSize
+        self.parallelCameras = parallelCameras
+        self.captureOrderer = captureOrderer
+        self.journal = journal
+        self.resume = resume
+        if outputFormat not in ("png", "raw"):
+            raise ValueError("Unknown output format '%s'" % outputFormat)
+        self.outputFormat = outputFormat
+        self.container = FrameContainer(os.path.join(path, CONTAINER_NAME)) if container else None
+        self.exposure = exposure
+        self.aeStep = aeStep
+        self.aeWindow = aeWindow
+        self.cameraExecutors = {}
+        self.total = self.computeTotal()
+        self.current = 0
+        self.timings = StageTimings()
+        self._cancel = threading.Event()
+        self._stepLock = threading.Lock()
+
+    def cancel(self):
+        # Safe to call from any thread, the loop will stop at the next check
+        self._cancel.set()
+
+    def isCancelled(self):
+        return self._cancel.is_set()
+
+    def checkCancelled(self):
+        if self._cancel.is_set():
+            raise CaptureCancelled()
+
+    def run(self):
+        # Returns True if every capture was taken, False if we were cancelled
+        self.current = 0
+        self.timings = StageTimings()
+        if self.journal is not None:
+            self.journal.open(self.resume)
+        if self.container is not None:
+            os.makedirs(self.path, exist_ok=True)
+            self.container.open("a" if self.resume else "w")
+        self.writer = FrameWriter(self.writerThreads, self.queueSize, self.timings)
+        if self.captureOrderer:
+            self.captureOrderer.reset()
+        if self.exposure is not None:
+            self.exposure.reset()
+        completed = False
+        try:
+            for position in self.panorama.positions:
+                self.checkCancelled()
+                captures = self.skipDone(position)
+                # Nothing left to take here, so don't even move
+                if not captures:
+                    self.step()
+                    continue
+                self.listener.positionStarted(position)
+                with self.timings.timed("move"):
+                    self.moveTo(position)
+                self.step()
+                self.capturePosition(position, captures)
+            completed = True
+        except CaptureCancelled:
+            pass
+        except Exception:
+            # Whatever went wrong, we can't trust what we think the cameras have
+            invalidateCameras(self.api)
+            raise
+        finally:
+            for executor in self.cameraExecutors.values():
+                executor.shutdown()
+            self.cameraExecutors = {}
+            # Anything already captured is worth keeping, so let the writers finish
+            self.writer.close()
+            if self.journal is not None:
+                self.journal.close()
+            if self.container is not None:
+                self.container.close()
+        self.writer.raiseError()
+        self.listener.runFinished(completed)
+        return completed
+
+    def step(self):
+        # Called from the writer threads as well as the capture loop
+        with self._stepLock:
+            self.current += 1
+            current = self.current
+        self.listener.progress(current, self.total)
+
+    def moveTo(self, position):
+        # Going through the shared state lets the GUI follow the PTU for free
+        state = ptuState(self.api)
+        with self.traceSpan("ptu.pan", None, position, pan=position.pan):
+            state.setPan(position.pan)
+        self.checkCancelled()
+        with self.traceSpan("ptu.tilt", None, position, tilt=position.tilt):
+            state.setTilt(position.tilt)
+
+    def skipDone(self, position):
+        # Returns the captures at position still to be taken
+        if self.journal is None or not self.resume:
+            return position.captures
+        captures = []
+        for capture in position.captures:
+            if self.journal.isDone(position, capture, self.container):
+                self.listener.captureSkipped(position, capture, self.fileName(capture, position))
+                self.step()
+            else:
+                captures.append(capture)
+        return captures
+
+    def capturePosition(self, position, captures=None):
+        if captures is None:
+            captures = position.captures
+        if self.captureOrderer:
+            captures = self.captureOrderer.order(captures)
+
+        if not self.parallelCameras:
+            for capture in captures:
+                self.startCapture(capture, position)
+            return
+
+        # Each camera gets a single thread, so captures on the same camera
+        # still run in the order they were given
+        futures = []
+        for capture in captures:
+            executor = self.cameraExecutor(capture.camera)
+            futures.append(executor.submit(self.startCapture, capture, position))
+        # Every camera has to be done before the PTU can move again
+        concurrent.futures.wait(futures)
+        for future in futures:
+            future.result()
+
+    def cameraExecutor(self, camera):
+        if camera not in self.cameraExecutors:
+            self.cameraExecutors[camera] = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        return self.cameraExecutors[camera]
+
+    def startCapture(self, capture, position):
+        self.checkCancelled()
+        self.listener.captureStarted(position, capture)
+        self.capture(capture, position)
+
+    def capture(self, capture, position):
+        # Settings the camera already has aren't sent again
+        camera = cameraShadows(self.api)[capture.camera]
+        start = tracer.now()
+        serverAE = capture.aeMode == 1
+        # Mode 3 is client AE, run here
+        clientAE = capture.aeMode == 3
+        shutter = capture.shutter
+        if (serverAE or clientAE) and self.exposure is not None:
+            shutter = self.exposure.seed(position, capture)
+        with self.timings.timed("configure"), self.traceSpan("capture.configure", capture, position):
+            self.configure(camera, capture, shutter)
+        self.checkCancelled()
+        with self.timings.timed("acquire"), self.traceSpan("capture.acquire", capture, position):
+            if clientAE:
+                ae = aeFromCapture(capture, self.aeStep, self.aeWindow)
+                readout = MeteringReadout(ae)
+                try:
+                    (image, settled, iterations) = ae.converge(camera, shutter, readout)
+                    image = readout.finish(camera, image)
+                finally:
+                    readout.restore(camera)
+            else:
+                image = camera.get_image(ae=serverAE)
+        if self.exposure is not None:
+            if clientAE:
+                self.exposure.remember(position, capture, shutter, settled, iterations)
+            elif serverAE:
+                self.rememberExposure(camera, image, capture, position, shutter)
+        self.checkCancelled()
+        self.save(image, capture, position, start)
+
+    def rememberExposure(self, camera, image, capture, position, seed):
+        # The frame's metadata says what shutter the AE settled on. Without it
+        # there's nothing to remember, the camera's shutter may only be the
+        # one we set before the AE ran
+        shutter = (getattr(image, "metadata", None) or {}).get("shutter")
+        try:
+            shutter = float(shutter)
+        except (TypeError, ValueError):
+            return
+        # Not every camera says how many iterations the AE took
+        iterations = getattr(camera, "aeIterations", None)
+        self.exposure.remember(position, capture, seed, shutter, iterations)
+
+    def configure(self, camera, capture, shutter=None):
+        camera.filter = capture.filter
+        camera.gain = capture.gain
+        camera.shutter = capture.shutter if shutter is None else shutter
+        camera.shutter_target = capture.shutter_target
+        if capture.roi[2] and capture.roi[3]:
+            camera.ae_meter_region = 1
+            camera.roi = capture.roi
+        else:
+            camera.ae_meter_region = 0
+
+        # Mode 1 is server AE, which is requested through get_image() instead
+        if capture.aeMode == 2:
+            camera.shutter_mode = 1
+        else:
+            camera.shutter_mode = 0
+
+        camera.ae_algorithm = capture.aeAlg
+        camera.ae_target = capture.aeTarget
+        camera.ae_tolerance = capture.aeTol
+        camera.ae_max_shutter = capture.aeMax
+        camera.ae_min_shutter = capture.aeMin
+        camera.ae_adjust_rate = capture.aeRate
+        camera.ae_outliers = capture.aeOutliers
+
+    def traceSpan(self, name, capture, position, **args):
+        # Describing the capture costs more than a span that isn't recorded,
+        # so it's only done while tracing
+        if not tracer.enabled:
+            return tracer.span(name)
+        args.update(self.traceArgs(capture, position))
+        return tracer.span(name, **args)
+
+    def traceArgs(self, capture, position):
+        if capture is None:
+            return dict(position=str(position))
+        return dict(position=str(position), capture=capture.name, camera=capture.camera, filter=capture.filter)
+
+    def save(self, image, capture, position, start=None):
+        # Create a file/folder structure to store the images, cameras running
+        # in parallel may both try to create it
+        fileName = self.fileName(capture, position)
+        if self.container is None:
+            os.makedirs(os.path.dirname(fileName), exist_ok=True)
+
+        def written():
+            # One span per frame, from configuring the camera to the file being written
+            if start is not None and tracer.enabled:
+                tracer.record("frame", start, tracer.now(), dict(file=fileName, **self.traceArgs(capture, position)))
+            # Only once the file is safely on disk
+            if self.journal is not None:
+                if self.container is not None:
+                    self.journal.record(position, capture, self.container.fileName,
+                                        frame=self.container.find(position, capture.name))
+                elif self.outputFormat == "raw":
+                    self.journal.record(position, capture, fileName, (headerName(fileName),))
+                else:
+                    self.journal.record(position, capture, fileName)
+            self.listener.captureFinished(position, capture, fileName)
+            self.step()
+
+        # Blocks while the queue is full, so a slow disk holds back the PTU
+        def saveFrame(image, fileName):
+            self.saveFrame(image, fileName, capture, position)
+
+        self.writer.submit(image, fileName, written, saveFrame)
+        return fileName
+
+    def fileName(self, capture, position):
+        name = "%s_%d_%d.%s" % (capture.name, capture.camera, capture.filter, self.outputFormat)
+        return os.path.join(self.path, str(position), name)
+
+    def saveFrame(self, image, fileName, capture, position):
+        # Runs on the writer threads
+        if self.container is not None:
+            # Found again by position and capture, the name is for extracting
+            (data, fields) = encodeFrame(image, self.outputFormat)
+            name = os.path.relpath(fileName, self.path).replace(os.sep, "/")
+            self.container.add(name, data, position=str(position), capture=capture.name,
+                               camera=capture.camera, filter=capture.filter, **fields)
+        elif self.outputFormat == "raw":
+            writeRaw(image, fileName)
+        else:
+            image.save_png_with_metadata(fileName)
+
+    def computeTotal(self):
+        total = 0
+        total += len(self.panorama)
+        for position in self.panorama.positions:
+            total += len(position.captures)
+        return total
+
+# File name of the container in the output folder, when one is used
+CONTAINER_NAME = "panorama.acepack"
+
+class FrameWriter(object):
+    """
+    Encodes and writes captured frames on a pool of threads. The queue between
+    the capture loop and the writers is bounded, so submit() blocks when the
+    writers fall behind rather than buffering frames without limit.
+    """
+
+    def __init__(self, threads, queueSize, timings, save=None):
+        self.timings = timings
+        # Called as save(image, fileName), PNG with metadata if not given
+        self.save = save if save else (lambda image, fileName: image.save_png_with_metadata(fileName))
+        self.queue = queue.Queue(max(1, queueSize))
+        self.error = None
+        self.threads = []
+        for i in range(max(1, threads)):
+            thread = threading.Thread(target=self._work, name="FrameWriter-%d" % i)
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    def submit(self, image, fileName, done=None, save=None):
+        # save, if given, is used for this frame instead of the writer's own
+        # Don't keep capturing if the frames can't be saved
+        self.raiseError()
+        with self.timings.timed("queueWait"):
+            self.queue.put((image, fileName, done, save if save else self.save))
+
+    def close(self):
+        # One sentinel per thread, each stops after taking one
+        for thread in self.threads:
+            self.queue.put(None)
+        for thread in self.threads:
+            thread.join()
+
+    def raiseError(self):
+        if self.error:
+            raise self.error
+
+    def _work(self):
+        while True:
+            with self.timings.timed("writerIdle"):
+                item = self.queue.get()
+            if item is None:
+                return
+            (image, fileName, done, save) = item
+            # Once one write has failed the rest are just drained
+            if self.error:
+                continue
+            try:
+                with self.timings.timed("write"), tracer.span("image.save", file=fileName):
+                    save(image, fileName)
+                if done:
+                    done()
+            except Exception as error:
+                self.error = error
+
+def engineFromConfig(config, api, panorama, path, listener=None, resume=False):
+    # Builds an engine with the options from the MIT_ config settings
+    journal = CaptureJournal(path) if config.MIT_Journal else None
+    exposure = ExposureMemory() if config.MIT_WarmStartAE else None
+    orderer = None
+    if config.MIT_OrderCaptures:
+        # The first entry in each filter list is the default, not a filter
+        wheels = {0: len(config.LWACFilters) - 1, 1: len(config.RWACFilters) - 1}
+        orderer = CaptureOrderer(wheels, config.MIT_WheelStepCost, config.MIT_CameraSwitchCost)
+    return CaptureEngine(api, panorama, path, listener,
+                         writerThreads=config.MIT_WriterThreads,
+                         queueSize=config.MIT_WriteQueueSize,
+                         parallelCameras=config.MIT_ParallelCameras,
+                         captureOrderer=orderer,
+                         journal=journal,
+                         resume=resume,
+                         outputFormat=config.MIT_OutputFormat,
+                         container=config.MIT_OutputContainer,
+                         exposure=exposure,
+                         aeStep=config.MIT_ClientAEStep,
+                         aeWindow=config.MIT_ClientAEWindow)
+
+class CaptureListener(object):
+    """
+    Receives progress from a CaptureEngine. Methods are called on the thread
+    running the engine, except captureStarted(), captureFinished() and
+    progress() which may also come from the camera and writer threads.
+    Subclasses should override the ones they need.
+    """
+
+    def positionStarted(self, position):
+        pass
+
+    def captureStarted(self, position, capture):
+        pass
+
+    def captureFinished(self, position, capture, fileName):
+        pass
+
+    def captureSkipped(self, position, capture, fileName):
+        pass
+
+    def progress(self, current, total):
+        pass
+
+    def runFinished(self, completed):
+        pass
+
+class CaptureCancelled(Exception):
+    pass
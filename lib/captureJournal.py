@@ -0,0 +1,158 @@
+# -- captureJournal.py - Record of completed captures for ace-ng --
+# Author:     Owen Tourlamain
+# Supervisor: Dr. Laurence Tyler
+
+import os
+import json
+import hashlib
+import threading
+
+class CaptureJournal(object):
+    """
+    captureJournal.py
+
+    An append-only record, kept in the output directory, of every capture a
+    panorama run has finished. Each line is a JSON object with the position,
+    the capture, a hash of its settings and the file it went to. A capture
+    is only recorded once its file has been synced to disk, and each line is
+    synced before the next is written, so after a crash the journal never
+    claims more than is really there.
+
+    Resuming a run skips every capture the journal has with the same settings
+    and a file that still exists. Frames in a FrameContainer are recorded with
+    where their record is, and only count as done if the container still has
+    that record, as one cut short by a crash is dropped when it is reopened.
+
+        from lib.captureJournal import CaptureJournal
+        journal = CaptureJournal("/data/pan1")
+        journal.open(resume=True)
+        if not journal.isDone(position, capture):
+            ...
+            journal.record(position, capture, fileName)
+        journal.close()
+    """
+
+    FILE_NAME = "journal.jsonl"
+
+    def __init__(self, path):
+        self.path = path
+        self.fileName = os.path.join(path, self.FILE_NAME)
+        self.done = {}
+        self.file = None
+        self._syncedDirs = set()
+        self._lock = threading.Lock()
+
+    def open(self, resume=False):
+        # Without resume this is a new run, and the old journal is thrown away
+        os.makedirs(self.path, exist_ok=True)
+        self.done = self.read() if resume else {}
+        if resume:
+            self.trimPartialLine()
+        self.file = open(self.fileName, "a" if resume else "w")
+        self._syncedDirs = set()
+
+    def close(self):
+        if self.file:
+            self.file.close()
+            self.file = None
+
+    def read(self):
+        done = {}
+        if not os.path.exists(self.fileName):
+            return done
+        with open(self.fileName) as file:
+            for line in file:
+                # A line cut short by a crash is just ignored
+                if not line.endswith("\n"):
+                    break
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                done[(entry["position"], entry["capture"])] = entry
+        return done
+
+    def trimPartialLine(self):
+        # Cut off anything after the last complete line, or the next entry
+        # would be glued on to the end of it
+        if not os.path.exists(self.fileName):
+            return
+        with open(self.fileName, "rb+") as file:
+            data = file.read()
+            if data and not data.endswith(b"\n"):
+                file.truncate(data.rfind(b"\n") + 1)
+
+    def isDone(self, position, capture, container=None):
+        # container is the open FrameContainer frames go in, if they do
+        entry = self.done.get((str(position), capture.name))
+        if entry is None or entry["hash"] != settingsHash(position, capture):
+            return False
+        if container is not None:
+            record = container.find(position, capture.name)
+            frame = entry.get("frame")
+            return record is not None and (frame is None or
+                                           (frame["offset"], frame["length"]) == (record["offset"], record["length"]))
+        fileName = os.path.join(self.path, entry["file"])
+        # Raw frames may have been converted to PNG since
+        return os.path.exists(fileName) or os.path.exists(os.path.splitext(fileName)[0] + ".png")
+
+    def pending(self, position, container=None):
+        return [capture for capture in position.captures if not self.isDone(position, capture, container)]
+
+    def record(self, position, capture, fileName, otherFiles=(), frame=None):
+        # Called from the writer threads once the file, and any others that
+        # go with it, have been written. frame is the container's index entry
+        # when fileName is a FrameContainer
+        for name in (fileName,) + tuple(otherFiles):
+            syncFile(name)
+        directory = os.path.dirname(os.path.abspath(fileName))
+        entry = dict(
+            position=str(position),
+            capture=capture.name,
+            camera=capture.camera,
+            filter=capture.filter,
+            hash=settingsHash(position, capture),
+            file=os.path.relpath(fileName, self.path),
+        )
+        if frame is not None:
+            entry["frame"] = dict(offset=frame["offset"], length=frame["length"])
+        with self._lock:
+            # A new directory's entry has to be on disk too, or the file could vanish
+            if directory not in self._syncedDirs:
+                syncDirectory(directory)
+                self._syncedDirs.add(directory)
+            self.file.write(json.dumps(entry, sort_keys=True) + "\n")
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.done[(entry["position"], entry["capture"])] = entry
+
+    def __len__(self):
+        return len(self.done)
+
+def settingsHash(position, capture):
+    # Anything that changes what would be captured changes the hash
+    settings = [position.pan, position.tilt, capture.camera, capture.filter, capture.gain,
+                capture.shutter, capture.shutter_target, list(capture.roi), capture.aeMode,
+                capture.aeAlg, capture.aeTarget, capture.aeTol, capture.aeMax, capture.aeMin,
+                capture.aeRate, capture.aeOutliers]
+    return hashlib.sha1(json.dumps(settings).encode()).hexdigest()
+
+def syncFile(fileName):
+    file = os.open(fileName, os.O_RDONLY)
+    try:
+        os.fsync(file)
+    finally:
+        os.close(file)
+
+def syncDirectory(directory):
+    # Not every platform can open a directory, there is nothing to do there
+    try:
+        file = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(file)
+    except OSError:
+        pass
+    finally:
+        os.close(file)
@@ -0,0 +1,135 @@
+# -- captureOrder.py - Filter wheel aware capture ordering for ace-ng --
+# Author:     Owen Tourlamain
+# Supervisor: Dr. Laurence Tyler
+
+class CaptureOrderer(object):
+    """
+    captureOrder.py
+
+    Reorders the captures at each panorama position so the filter wheels and
+    cameras change as little as possible. Captures are grouped by camera, and
+    each camera's filters are visited in a sweep around its wheel starting
+    from wherever the wheel was left at the previous position. Successive
+    positions therefore sweep back and forth over the wheel.
+
+    The orderer remembers the wheels between calls, so use one per run.
+
+        from lib.captureOrder import CaptureOrderer
+        orderer = CaptureOrderer({0: 11, 1: 11}, wheelStepCost=0.5)
+        for position in panorama.positions:
+            captures = orderer.order(position.captures)
+    """
+
+    def __init__(self, wheelSizes, wheelStepCost=1.0, cameraSwitchCost=1.0, verbose=False):
+        # wheelSizes maps camera number to the number of filters on its
+        # wheel, cameras without one don't have filters to change
+        self.wheelSizes = wheelSizes
+        self.wheelStepCost = wheelStepCost
+        self.cameraSwitchCost = cameraSwitchCost
+        self.verbose = verbose
+        self.reset()
+
+    def reset(self):
+        self.wheels = {}
+        self.lastCamera = None
+
+    def order(self, captures):
+        captures = list(captures)
+        if not captures:
+            return captures
+        before = self.cost(captures)
+
+        # Group by camera in the order they first appear, but carry on with
+        # the camera we finished the last position on
+        groups = {}
+        cameras = []
+        for capture in captures:
+            if capture.camera not in groups:
+                groups[capture.camera] = []
+                cameras.append(capture.camera)
+            groups[capture.camera].append(capture)
+        if self.lastCamera in groups:
+            cameras.remove(self.lastCamera)
+            cameras.insert(0, self.lastCamera)
+
+        ordered = []
+        for camera in cameras:
+            ordered.extend(self.orderFilters(camera, groups[camera]))
+
+        if self.verbose:
+            print("Estimated capture overhead: %.1fs -> %.1fs" % (before, self.cost(ordered)))
+        self.advance(ordered)
+        return ordered
+
+    def orderFilters(self, camera, captures):
+        size = self.wheelSizes.get(camera)
+        if not size:
+            return captures
+        # Filter 0 is the default, it doesn't need the wheel to move
+        ordered = [capture for capture in captures if capture.filter == 0]
+        filters = []
+        for capture in captures:
+            if capture.filter and capture.filter not in filters:
+                filters.append(capture.filter)
+        for filter in self.sweep(filters, self.wheels.get(camera), size):
+            # Captures sharing a filter keep their original order
+            ordered.extend(capture for capture in captures if capture.filter == filter)
+        return ordered
+
+    def sweep(self, filters, start, size):
+        if not filters:
+            return []
+        if start is None:
+            # With nowhere to start from, begin just after the biggest gap
+            # between filters and go round once
+            filters = sorted(filters)
+            gaps = [(filters[i] - filters[i - 1]) % size for i in range(len(filters))]
+            first = gaps.index(max(gaps)) if len(filters) > 1 else 0
+            return filters[first:] + filters[:first]
+
+        # Anything on the current filter goes first, for free
+        current = [start] if start in filters else []
+        # Distance of each other filter going forwards round the wheel
+        offsets = sorted(((filter - start) % size, filter) for filter in filters if filter != start)
+        best = None
+        # Go forwards to the m'th filter and then back for the rest, or back
+        # first and then forwards, whichever moves the wheel least
+        for m in range(len(offsets) + 1):
+            forward = offsets[m - 1][0] if m else 0
+            backward = size - offsets[m][0] if m < len(offsets) else 0
+            # Never worth coming back if nothing is left on the other side
+            for (cost, forwardFirst) in ((2 * forward + backward if backward else forward, True),
+                                         (2 * backward + forward if forward else backward, False)):
+                if best is None or cost < best[0]:
+                    best = (cost, forwardFirst, m)
+        (cost, forwardFirst, m) = best
+        forwards = [filter for (offset, filter) in offsets[:m]]
+        backwards = [filter for (offset, filter) in reversed(offsets[m:])]
+        if forwardFirst:
+            return current + forwards + backwards
+        return current + backwards + forwards
+
+    def cost(self, captures):
+        # Estimated time spent on wheel moves and camera switches, starting
+        # from the state left by the previous position
+        wheels = dict(self.wheels)
+        lastCamera = self.lastCamera
+        total = 0.0
+        for capture in captures:
+            if lastCamera is not None and capture.camera != lastCamera:
+                total += self.cameraSwitchCost
+            lastCamera = capture.camera
+            size = self.wheelSizes.get(capture.camera)
+            if size and capture.filter:
+                current = wheels.get(capture.camera)
+                if current is not None:
+                    steps = abs(capture.filter - current) % size
+                    total += min(steps, size - steps) * self.wheelStepCost
+                wheels[capture.camera] = capture.filter
+        return total
+
+    def advance(self, captures):
+        for capture in captures:
+            if self.wheelSizes.get(capture.camera) and capture.filter:
+                self.wheels[capture.camera] = capture.filter
+            self.lastCamera = capture.camera
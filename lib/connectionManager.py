@@ -0,0 +1,96 @@
+# -- connectionManager.py - AUPE/FAUPE connection handling for ace-ng --
+# Author:     Owen Tourlamain
+# Supervisor: Dr. Laurence Tyler
+
+import time
+import socket
+import concurrent.futures
+
+class ConnectionManager(object):
+    """
+    connectionManager.py
+
+    Connects the API to an AUPE or FAUPE agent without fixed waits. With the
+    agent's port known, endpoints are probed with a plain TCP connection and
+    a short timeout, several at once, so an AUPE that isn't there costs
+    probeTimeout rather than the full connection timeout. A FAUPE that has
+    just been started is tried again with backoff, starting at a few tens of
+    milliseconds, until it answers, its process dies or timeout runs out.
+    Without a port every readiness check is a connection attempt through the
+    API instead, which takes as long as the API does to give up on an agent
+    that isn't there. Attempts are never cut short and left running, as one
+    that answered late would connect the shared API behind our back.
+
+        from lib.connectionManager import ConnectionManager
+        manager = ConnectionManager(api, port=config.agent_port)
+        address = manager.firstReady([config.aupe_addr, config.fake_aupe_addr])
+        manager.connect(address)
+        print(manager.waited)
+    """
+
+    def __init__(self, api, port=None, probeTimeout=0.5, timeout=10.0, verbose=False):
+        self.api = api
+        self.port = port
+        self.probeTimeout = probeTimeout
+        self.timeout = timeout
+        self.verbose = verbose
+        # Total time spent waiting for agents, for the startup report
+        self.waited = 0.0
+
+    def probe(self, address):
+        # True if something is listening on the agent port at address
+        try:
+            connection = socket.create_connection((address, self.port), self.probeTimeout)
+        except OSError:
+            return False
+        connection.close()
+        return True
+
+    def firstReady(self, addresses):
+        # The first of addresses, in order of preference, with an agent
+        # listening, or None. All of them are probed at once, but a later
+        # one is only picked once every earlier one has been ruled out
+        if self.port is None or not addresses:
+            return None
+        start = time.perf_counter()
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=len(addresses))
+        try:
+            futures = [executor.submit(self.probe, address) for address in addresses]
+            for (address, future) in zip(addresses, futures):
+                if future.result():
+                    return address
+            return None
+        finally:
+            executor.shutdown(wait=False)
+            self.report("probing %s" % ", ".join(addresses), time.perf_counter() - start)
+
+    def connect(self, address, process=None):
+        # Connects to address, waiting with backoff if process, the agent
+        # we have just started, isn't ready yet. Raises the last error if
+        # it never is
+        start = time.perf_counter()
+        delay = 0.02
+        try:
+            while True:
+                if self.port is None or self.probe(address):
+                    try:
+                        self.api.system.connect(agent_addr=address)
+                        return
+                    except OSError:
+                        if process is None:
+                            raise
+                elif process is None:
+                    raise ConnectionRefusedError("Nothing is listening on %s:%d" % (address, self.port))
+                if process.poll() is not None:
+                    raise ConnectionRefusedError("The agent for %s exited with status %d" % (address, process.returncode))
+                if time.perf_counter() - start + delay > self.timeout:
+                    raise ConnectionRefusedError("The agent for %s was not ready after %.0fs" % (address, self.timeout))
+                time.sleep(delay)
+                delay = min(delay * 2, 1.0)
+        finally:
+            self.report("connecting to %s" % address, time.perf_counter() - start)
+
+    def report(self, what, seconds):
+        self.waited += seconds
+        if self.verbose:
+            print("Spent %.0fms %s" % (seconds * 1000, what))
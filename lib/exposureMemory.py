@@ -0,0 +1,105 @@
+# -- exposureMemory.py - Auto exposure warm starts for ace-ng --
+# Author:     Owen Tourlamain
+# Supervisor: Dr. Laurence Tyler
+
+import math
+import threading
+from collections import deque
+
+class ExposureMemory(object):
+    """
+    exposureMemory.py
+
+    Remembers the shutter server auto exposure settled on for each capture,
+    so the next time the same camera, filter, gain and ROI is used the AE can
+    start from there instead of the capture's own shutter. Panorama positions
+    are visited in order, so the nearest one remembered is almost always a
+    neighbour looking at a similar scene, and the AE only needs an iteration
+    or two to settle.
+
+    Only the last few positions for each capture are kept, which covers the
+    row above in a serpentine path without having to search the whole run.
+
+    How many exposures a warm start saved is always an estimate, as nobody
+    knows how many a cold start would have taken, and so is the iteration
+    count unless the camera reports its own.
+
+        from lib.exposureMemory import ExposureMemory
+        memory = ExposureMemory()
+        seed = memory.seed(position, capture)
+        camera.shutter = seed
+        image = camera.get_image(ae=True)
+        memory.remember(position, capture, seed, camera.shutter)
+        print(memory.summary())
+    """
+
+    def __init__(self, history=64):
+        self.history = history
+        self.shutters = {}
+        self.warmStarts = 0
+        self.iterations = 0
+        self.saved = 0
+        # Whether any of the iterations counted had to be estimated
+        self.estimated = False
+        # Cameras running in parallel report from their own threads
+        self._lock = threading.Lock()
+
+    def reset(self):
+        with self._lock:
+            self.shutters = {}
+            self.warmStarts = 0
+            self.iterations = 0
+            self.saved = 0
+            self.estimated = False
+
+    def seed(self, position, capture):
+        # The shutter to start the AE from, the capture's own if nothing is known
+        with self._lock:
+            remembered = self.shutters.get(exposureKey(capture))
+            if not remembered:
+                return capture.shutter
+            nearest = min(remembered, key=lambda entry: (entry[0] - position.pan) ** 2 + (entry[1] - position.tilt) ** 2)
+            return nearest[2]
+
+    def remember(self, position, capture, seed, shutter, iterations=None):
+        # seed is the shutter the AE was started from, shutter where it ended
+        # up, iterations how many it took if the camera could tell us
+        if not shutter:
+            return
+        cold = estimateIterations(capture.shutter, shutter, capture)
+        # Without a count from the camera the warm start is estimated the same way
+        warm = iterations if iterations is not None else estimateIterations(seed, shutter, capture)
+        with self._lock:
+            key = exposureKey(capture)
+            if key not in self.shutters:
+                self.shutters[key] = deque(maxlen=self.history)
+            self.shutters[key].append((position.pan, position.tilt, shutter))
+            if seed != capture.shutter:
+                self.warmStarts += 1
+                self.saved += max(cold - warm, 0)
+            self.iterations += warm
+            self.estimated = self.estimated or iterations is None
+
+    def summary(self):
+        with self._lock:
+            return dict(warmStarts=self.warmStarts, iterations=self.iterations,
+                        iterationsEstimated=self.estimated, estimatedSaved=self.saved)
+
+def exposureKey(capture):
+    # Anything that changes the shutter needed for the same scene
+    return (capture.camera, capture.filter, capture.gain, tuple(capture.roi))
+
+def estimateIterations(start, shutter, capture):
+    # How many exposures the server AE would take to get from start to
+    # shutter, each one moving aeRate of the way and stopping once the level
+    # is within aeTol of aeTarget, using the server's defaults for anything unset
+    target = capture.aeTarget or 0.5
+    tolerance = capture.aeTol or 0.05
+    rate = capture.aeRate or 0.5
+    start = start or 0.01
+    error = target * abs(start - shutter) / shutter
+    if error <= tolerance:
+        return 1
+    if rate >= 1:
+        return 2
+    return 1 + int(math.ceil(math.log(tolerance / error) / math.log(1 - rate)))
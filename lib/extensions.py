@@ -0,0 +1,106 @@
+# -- extensions.py - Extension discovery and loading for ace-ng --
+# Author:     Owen Tourlamain
+# Supervisor: Dr. Laurence Tyler
+
+import os
+import json
+import time
+import pkgutil
+import importlib
+from PyQt5.QtWidgets import QVBoxLayout, QWidget
+
+# Lists the extensions in tab order, with the strings key of each one's title
+MANIFEST = "manifest.json"
+
+class Extension(object):
+    """
+    extensions.py
+
+    One tab module in ext/, imported and built only when asked for. Each
+    module has a Tab class taking (config, strings, api, verbose) and giving
+    itself a title. The time the import and the build took is kept, for
+    ace-ng -v to report.
+
+    Extensions listed in ext/manifest.json have their title there, so their
+    tab can be put up without importing anything, and is only built when it
+    is first shown. Any other module in ext/ still works, it just has to be
+    built straight away to find out its title.
+
+        from lib.extensions import discoverExtensions
+        for extension in discoverExtensions("ext"):
+            tab = extension.create(config, strings, api, verbose)
+    """
+
+    def __init__(self, name, title=None, package="ext"):
+        self.name = name
+        # Key into the strings for the title, None if only the tab knows it
+        self.title = title
+        self.package = package
+        self.module = None
+        self.tab = None
+        self.importTime = 0.0
+        self.buildTime = 0.0
+
+    def load(self):
+        if self.module is None:
+            start = time.perf_counter()
+            self.module = importlib.import_module("%s.%s" % (self.package, self.name))
+            self.importTime = time.perf_counter() - start
+        return self.module
+
+    def create(self, config, strings, api, verbose):
+        if self.tab is None:
+            tabClass = self.load().Tab
+            start = time.perf_counter()
+            self.tab = tabClass(config, strings, api, verbose)
+            self.buildTime = time.perf_counter() - start
+            if verbose:
+                print("Loaded extension %s: import %.0fms, build %.0fms" %
+                      (self.name, self.importTime * 1000, self.buildTime * 1000))
+        return self.tab
+
+    def titleText(self, strings):
+        return getattr(strings, self.title) if self.title else self.tab.title
+
+def discoverExtensions(path, package="ext"):
+    # The extensions in the manifest, in its order, then anything else in
+    # path alphabetically
+    extensions = []
+    manifest = os.path.join(path, MANIFEST)
+    if os.path.exists(manifest):
+        with open(manifest) as file:
+            for entry in json.load(file):
+                extensions.append(Extension(entry["module"], entry.get("title"), package))
+    listed = set(extension.name for extension in extensions)
+    found = set(name for (finder, name, isPackage) in pkgutil.iter_modules([path]) if not isPackage)
+    # A listed module that has gone is left out rather than failing later
+    extensions = [extension for extension in extensions if extension.name in found]
+    for name in sorted(found - listed):
+        extensions.append(Extension(name, None, package))
+    return extensions
+
+class LazyTab(QWidget):
+    """
+    Stands in for an extension's tab until the first time it is shown, then
+    builds the real one inside itself.
+    """
+
+    def __init__(self, extension, config, strings, api, verbose):
+        super(LazyTab, self).__init__()
+        self.extension = extension
+        self.arguments = (config, strings, api, verbose)
+        layout = QVBoxLayout()
+        layout.setContentsMargins(0, 0, 0, 0)
+        self.setLayout(layout)
+
+    def isBuilt(self):
+        return self.extension.tab is not None
+
+    def build(self):
+        if not self.isBuilt():
+            self.layout().addWidget(self.extension.create(*self.arguments))
+        return self.extension.tab
+
+    def showEvent(self, event):
+        self.build()
+        super(LazyTab, self).showEvent(event)
@@ -0,0 +1,207 @@
+# -- frameContainer.py - Single file panorama output for ace-ng --
+# Author:     Owen Tourlamain
+# Supervisor: Dr. Laurence Tyler
+
+import io
+import os
+import json
+import struct
+import threading
+from lib.rawFrames import writeUnbuffered, pngInfo
+
+class FrameContainer(object):
+    """
+    frameContainer.py
+
+    Holds every frame of a panorama run in one append-only file, which is far
+    quicker to copy off the rover than thousands of small ones. Each frame is
+    written as a record with a small JSON header followed by its data, and an
+    index of every frame is written on the end when the container is closed:
+
+        ACEPACK1
+        ACEFRAME <header length> <header> <data>    once per frame
+        ...
+        <index> <index offset> ACEINDEX
+
+    If the index never got written, because of a crash, the records can still
+    be found by reading through the file, which open() does by itself.
+
+        from lib.frameContainer import FrameContainer
+        container = FrameContainer("/data/pan1/panorama.acepack")
+        container.open("w")
+        container.add("TL/LWAC-Red_0_3.png", data, position="TL", capture="LWAC-Red")
+        container.close()
+
+        container.open("r")
+        (entry, data) = container.get("TL", "LWAC-Red")
+    """
+
+    MAGIC = b"ACEPACK1"
+    RECORD = b"ACEFRAME"
+    INDEX = b"ACEINDEX"
+    HEADER = struct.Struct("<I")
+    TRAILER = struct.Struct("<Q")
+
+    def __init__(self, fileName):
+        self.fileName = fileName
+        self.entries = []
+        self.keys = {}
+        self.file = None
+        self.mode = None
+        self._lock = threading.Lock()
+
+    def open(self, mode="r"):
+        # "r" reads, "w" starts a new container and "a" adds to an existing one
+        self.mode = mode
+        if mode == "w":
+            self.entries = []
+            self.keys = {}
+            self.file = open(self.fileName, "w+b")
+            self.file.write(self.MAGIC)
+            return
+        if mode == "a" and not os.path.exists(self.fileName):
+            self.open("w")
+            return
+        self.file = open(self.fileName, "r+b" if mode == "a" else "rb")
+        if self.file.read(len(self.MAGIC)) != self.MAGIC:
+            self.file.close()
+            raise ValueError("'%s' is not a frame container" % self.fileName)
+        end = self.readIndex()
+        if end is None:
+            end = self.scan()
+        if mode == "a":
+            # New frames go where the index was, it is written again on close
+            self.file.truncate(end)
+        self.file.seek(end)
+
+    def close(self):
+        if self.file is None:
+            return
+        if self.mode in ("w", "a"):
+            with self._lock:
+                self.file.seek(0, os.SEEK_END)
+                offset = self.file.tell()
+                self.file.write(json.dumps(self.entries, sort_keys=True).encode())
+                self.file.write(self.TRAILER.pack(offset) + self.INDEX)
+                self.file.flush()
+                os.fsync(self.file.fileno())
+        self.file.close()
+        self.file = None
+
+    def add(self, name, data, **fields):
+        # name is where the frame would go in the directory layout, fields
+        # should include the position and capture it can be looked up by
+        entry = dict(fields, name=name, length=len(data))
+        header = json.dumps(entry, sort_keys=True).encode()
+        with self._lock:
+            self.file.seek(0, os.SEEK_END)
+            self.file.write(self.RECORD + self.HEADER.pack(len(header)) + header)
+            entry["offset"] = self.file.tell()
+            self.file.write(data)
+            # Flushed so a sync of the file name by someone else covers it
+            self.file.flush()
+            self.remember(entry)
+        return entry
+
+    def get(self, position, capture):
+        entry = self.keys[(str(position), capture)]
+        return (entry, self.read(entry))
+
+    def find(self, position, capture):
+        # The index entry for a frame, None if the container doesn't have it
+        return self.keys.get((str(position), capture))
+
+    def read(self, entry):
+        with self._lock:
+            self.file.seek(entry["offset"])
+            return self.file.read(entry["length"])
+
+    def remember(self, entry):
+        key = (entry.get("position"), entry.get("capture"))
+        # A frame taken again replaces the old one
+        if key in self.keys:
+            self.entries.remove(self.keys[key])
+        self.keys[key] = entry
+        self.entries.append(entry)
+
+    def readIndex(self):
+        # Returns where the index starts, or None if there isn't one
+        size = self.file.seek(0, os.SEEK_END)
+        trailer = self.TRAILER.size + len(self.INDEX)
+        if size < len(self.MAGIC) + trailer:
+            return None
+        self.file.seek(size - trailer)
+        (offset,) = self.TRAILER.unpack(self.file.read(self.TRAILER.size))
+        if self.file.read(len(self.INDEX)) != self.INDEX or not len(self.MAGIC) <= offset <= size - trailer:
+            return None
+        self.file.seek(offset)
+        try:
+            entries = json.loads(self.file.read(size - trailer - offset).decode())
+        except ValueError:
+            return None
+        self.entries = []
+        self.keys = {}
+        for entry in entries:
+            self.remember(entry)
+        return offset
+
+    def scan(self):
+        # Walks the records from the start, returns where the last whole one ends
+        self.entries = []
+        self.keys = {}
+        end = len(self.MAGIC)
+        self.file.seek(end)
+        while True:
+            if self.file.read(len(self.RECORD)) != self.RECORD:
+                break
+            length = self.file.read(self.HEADER.size)
+            if len(length) != self.HEADER.size:
+                break
+            header = self.file.read(self.HEADER.unpack(length)[0])
+            try:
+                entry = json.loads(header.decode())
+            except ValueError:
+                break
+            entry["offset"] = self.file.tell()
+            # Cut short by a crash
+            if len(self.file.read(entry["length"])) != entry["length"]:
+                break
+            self.remember(entry)
+            end = self.file.tell()
+        return end
+
+    def __iter__(self):
+        return iter(list(self.entries))
+
+    def __len__(self):
+        return len(self.entries)
+
+def encodeFrame(image, format):
+    # Returns (data, fields) for a captured image, fields go in the index
+    pil = image.as_pil_image()
+    metadata = dict((str(key), str(value)) for (key, value) in (getattr(image, "metadata", None) or {}).items())
+    fields = dict(format=format, metadata=metadata, mode=pil.mode, size=list(pil.size))
+    if format == "raw":
+        return (pil.tobytes(), fields)
+    data = io.BytesIO()
+    pil.save(data, format="PNG", pnginfo=pngInfo(metadata))
+    return (data.getvalue(), fields)
+
+def extract(fileName, path, progress=None):
+    # Writes every frame out in the usual directory layout, raw frames get
+    # their JSON header so ace-ng convert can deal with them
+    container = FrameContainer(fileName)
+    container.open("r")
+    try:
+        for entry in container:
+            output = os.path.join(path, *entry["name"].split("/"))
+            os.makedirs(os.path.dirname(output), exist_ok=True)
+            writeUnbuffered(output, container.read(entry))
+            if entry.get("format") == "raw":
+                header = dict(mode=entry["mode"], size=entry["size"], metadata=entry["metadata"])
+                writeUnbuffered(os.path.splitext(output)[0] + ".json", json.dumps(header, sort_keys=True).encode())
+            if progress:
+                progress(entry, output)
+    finally:
+        container.close()
+    return len(container)
@@ -0,0 +1,182 @@
+# -- imageStats.py - Captured frame statistics for ace-ng --
+# Author:     Owen Tourlamain
+# Supervisor: Dr. Laurence Tyler
+
+import numpy
+from PyQt5.QtCore import QObject, QRunnable, QThreadPool, QPointF, pyqtSignal
+from PyQt5.QtGui import QColor, QPainter, QPainterPath, QPen
+from PyQt5.QtWidgets import QLabel, QSizePolicy, QVBoxLayout, QWidget
+from lib.tracing import tracer
+
+class ChannelStats(object):
+    """
+    imageStats.py
+
+    Exposure statistics for one channel of a frame, in the frame's own pixel
+    values. low and high are the levels with the outliers fraction of the
+    pixels below and above them, the same cut the AE makes. histogram always
+    has 256 bins, whatever the bit depth.
+
+        from lib.imageStats import frameStats
+        for channel in frameStats(image.as_pil_image(), outliers=0.01):
+            print(channel.name, channel.mean, channel.saturated)
+    """
+
+    __slots__ = ("name", "histogram", "mean", "low", "high", "saturated", "black")
+
+    def __init__(self, name, histogram, mean, low, high, saturated, black):
+        self.name = name
+        self.histogram = histogram
+        self.mean = mean
+        self.low = low
+        self.high = high
+        self.saturated = saturated
+        self.black = black
+
+def valueCounts(pil):
+    # Returns (counts, full), counts having a row per band of how many pixels
+    # have each value from 0 to full
+    if pil.mode in ("L", "RGB", "RGBA"):
+        # PIL counts 8 bit images in C, several times quicker than NumPy can
+        return (numpy.array(pil.histogram()).reshape(len(pil.getbands()), 256), 255)
+    pixels = numpy.asarray(pil)
+    if pixels.ndim == 2:
+        pixels = pixels[:, :, None]
+    if pixels.dtype.kind == "u" and pixels.dtype.itemsize <= 2:
+        full = int(numpy.iinfo(pixels.dtype).max)
+    else:
+        # Anything else is scaled into 16 bits first
+        pixels = numpy.clip(pixels, 0, None)
+        top = pixels.max() or 1
+        pixels = (pixels * (65535.0 / top)).astype(numpy.uint16)
+        full = 65535
+    counts = [numpy.bincount(pixels[:, :, band].ravel(), minlength=full + 1) for band in range(pixels.shape[2])]
+    return (numpy.array(counts), full)
+
+def frameStats(pil, outliers=0.01):
+    # Everything comes from one count of each pixel value, so the frame is
+    # only gone through once and nothing is sorted
+    (counts, full) = valueCounts(pil)
+    outliers = min(max(outliers, 0.0), 0.5)
+    values = numpy.arange(full + 1)
+    stats = []
+    for (name, band) in zip(pil.getbands(), counts):
+        total = float(band.sum())
+        cumulative = numpy.cumsum(band)
+        stats.append(ChannelStats(
+            name,
+            band.reshape(256, -1).sum(axis=1),
+            float(numpy.dot(values, band)) / total,
+            int(numpy.searchsorted(cumulative, outliers * total, side="right")),
+            int(numpy.searchsorted(cumulative, (1 - outliers) * total)),
+            float(band[full]) / total,
+            float(band[0]) / total,
+        ))
+    return stats
+
+class StatsRunner(QObject):
+    """
+    Works out frameStats() for captured images on a worker thread and hands
+    them to a HistogramPanel, so the next capture never waits on them. As
+    with previews, a panel given a new image before the last one was done
+    only gets the newest.
+
+        runner = StatsRunner()
+        runner.show(camera.get_image(), self.histogram, outliers=0.01)
+    """
+
+    computed = pyqtSignal(object, object, object)
+
+    def __init__(self, threads=1):
+        super(StatsRunner, self).__init__()
+        self.pool = QThreadPool()
+        self.pool.setMaxThreadCount(threads)
+        self.latest = {}
+        self.computed.connect(self._computed)
+
+    def show(self, image, panel, outliers=0.01):
+        token = object()
+        self.latest[id(panel)] = token
+        self.pool.start(_StatsJob(self, image, panel, outliers, token))
+
+    def wait(self):
+        self.pool.waitForDone()
+
+    def _computed(self, panel, token, stats):
+        if self.latest.get(id(panel)) is not token:
+            return
+        del self.latest[id(panel)]
+        panel.setStats(stats)
+
+class _StatsJob(QRunnable):
+
+    def __init__(self, runner, image, panel, outliers, token):
+        super(_StatsJob, self).__init__()
+        self.runner = runner
+        self.image = image
+        self.panel = panel
+        self.outliers = outliers
+        self.token = token
+
+    def run(self):
+        if self.runner.latest.get(id(self.panel)) is not self.token:
+            return
+        with tracer.span("image.stats"):
+            stats = frameStats(self.image.as_pil_image(), self.outliers)
+        self.runner.computed.emit(self.panel, self.token, stats)
+
+class HistogramPanel(QWidget):
+    """
+    A histogram of each channel, on a log scale so a few saturated pixels
+    still show up, with the channel statistics written underneath using
+    format, which is given the channel name, mean, low and high levels and
+    the saturated and black percentages.
+    """
+
+    # Line colours for the bands PIL uses
+    COLOURS = {"R": QColor(200, 0, 0), "G": QColor(0, 150, 0), "B": QColor(0, 0, 200)}
+
+    def __init__(self, format):
+        super(HistogramPanel, self).__init__()
+        self.format = format
+        self.stats = []
+        self.plot = _HistogramPlot(self)
+        self.text = QLabel()
+        self.text.setWordWrap(True)
+        layout = QVBoxLayout()
+        layout.setContentsMargins(0, 0, 0, 0)
+        layout.addWidget(self.plot)
+        layout.addWidget(self.text)
+        self.setLayout(layout)
+
+    def setStats(self, stats):
+        self.stats = stats
+        self.text.setText("\n".join(self.format % (channel.name, channel.mean, channel.low, channel.high,
+                                                   100 * channel.saturated, 100 * channel.black)
+                                    for channel in stats))
+        self.plot.update()
+
+class _HistogramPlot(QWidget):
+
+    def __init__(self, panel):
+        super(_HistogramPlot, self).__init__()
+        self.panel = panel
+        self.setMinimumHeight(60)
+        self.setSizePolicy(QSizePolicy(QSizePolicy.Expanding, QSizePolicy.Fixed))
+
+    def paintEvent(self, event):
+        painter = QPainter(self)
+        painter.setRenderHint(QPainter.Antialiasing)
+        painter.drawRect(0, 0, self.width() - 1, self.height() - 1)
+        stats = self.panel.stats
+        if not stats:
+            return
+        peak = max(numpy.log1p(channel.histogram).max() for channel in stats) or 1.0
+        (width, height) = (self.width() - 2, self.height() - 2)
+        for channel in stats:
+            heights = numpy.log1p(channel.histogram) / peak
+            path = QPainterPath(QPointF(1, height + 1))
+            for (bin, level) in enumerate(heights.tolist()):
+                path.lineTo(QPointF(1 + width * bin / 255.0, 1 + height * (1 - level)))
+            painter.setPen(QPen(HistogramPanel.COLOURS.get(channel.name, QColor(0, 0, 0))))
+            painter.drawPath(path)
@@ -0,0 +1,248 @@
+# -- panorama.py - Panorama plan model for ace-ng --
+# Author:     Owen Tourlamain
+# Supervisor: Dr. Laurence Tyler
+
+import json
+from xml.etree import ElementTree as xml
+from lib.pathOptimiser import PathOptimiser
+
+class Panorama(object):
+    """
+    panorama.py
+
+    The plan for a panorama, the positions to visit and the captures to take
+    at each, kept apart from the GUI so the capture engine, ace-ng --headless
+    and the benchmarks can use it without any widgets. Positions and captures
+    use __slots__, as a plan can hold tens of thousands of them, and the GUI
+    shows them through a model that only asks for the rows on screen.
+
+        from lib.panorama import Panorama, PanoramaPosition, Capture
+        panorama = Panorama()
+        position = PanoramaPosition(-10.0, 5.0, "TL")
+        position.captures.append(Capture("LWAC-Red", camera=0, filter=3))
+        panorama.add(position)
+    """
+
+    def __init__(self, optimiser=None):
+        super(Panorama, self).__init__()
+
+        self.positions = []
+        self.optimiser = optimiser if optimiser else PathOptimiser()
+
+    def __getitem__(self, item):
+        if item < len(self):
+            raise IndexError("Index out of range")
+        return self.positions[item]
+
+    def __len__(self):
+        return len(self.positions)
+
+    def add(self, item):
+        if not isinstance(item, PanoramaPosition):
+            raise ValueError("Panoramas can only contain PanoramaPositions")
+        self.positions.append(item)
+        self.sort()
+
+    def extend(self, items):
+        # Adds many positions with a single sort, rather than one per add()
+        for item in items:
+            if not isinstance(item, PanoramaPosition):
+                raise ValueError("Panoramas can only contain PanoramaPositions")
+            self.positions.append(item)
+        self.sort()
+
+    def remove(self, item):
+        if item in self.positions:
+            self.positions.remove(item)
+
+    def getIndex(self, item):
+        if item in self.positions:
+            return self.positions.index(item)
+        else:
+            return -1
+
+    def __str__(self):
+        string = ""
+        for position in self.positions:
+            string += "%s\n" % str(position)
+        return string
+
+    def sort(self):
+        # We need to make sure we put the least strain on the PTU as possible,
+        # the optimiser picks the order with the least estimated travel
+        self.positions = self.optimiser.order(self.positions)
+
+class PanoramaPosition(object):
+
+    __slots__ = ("pan", "tilt", "name", "captures")
+
+    def __init__(self, pan, tilt, name):
+        self.pan = pan
+        self.tilt = tilt
+        self.name = name
+        self.captures = []
+
+    def __lt__(self, other):
+        # Matches the raster order, top left to bottom right
+        return (self.tilt, self.pan) > (other.tilt, other.pan)
+
+    def __str__(self):
+        if self.name:
+            return self.name
+        else:
+            return "(%.1f,%.1f)" % (self.pan, self.tilt)
+
+    def __eq__(self, other):
+        return self.pan == other.pan and self.tilt == other.tilt
+
+class Capture(object):
+
+    __slots__ = ("name", "camera", "filter", "gain", "shutter", "shutter_target", "roi",
+                 "aeMode", "aeAlg", "aeTarget", "aeTol", "aeMax", "aeMin", "aeRate", "aeOutliers")
+
+    def __init__(self, name, camera=0, filter=0, gain=0.0, shutter=0.0,
+                 shutter_target=0.0, roix=0, roiy=0, roiw=0, roih=0, aeMode=0,
+                 aeAlg=0, aeTarget=0.0, aeTol=0.0, aeMax=0.0, aeMin=0.0, aeRate=0.0, aeOutliers=0.0):
+        self.name = name
+        self.camera = camera
+        self.filter = filter
+        self.gain = gain
+        self.shutter = shutter
+        self.shutter_target = shutter_target
+        self.roi = (roix, roiy, roiw, roih)
+        self.aeMode = aeMode
+        self.aeAlg = aeAlg
+        self.aeTarget = aeTarget
+        self.aeTol = aeTol
+        self.aeMax = aeMax
+        self.aeMin = aeMin
+        self.aeRate = aeRate
+        self.aeOutliers = aeOutliers
+
+    def copy(self):
+        capture = Capture(self.name)
+        for attribute in self.__slots__:
+            setattr(capture, attribute, getattr(self, attribute))
+        return capture
+
+    def __str__(self):
+        return self.name
+
+    def __eq__(self, other):
+        return self.name == other.name
+
+class PanoramaSaver(object):
+
+    def __init__(self):
+        super(PanoramaSaver, self).__init__()
+
+    def dump(self, panorama, file):
+        xmlRoot = xml.Element("root")
+        for position in panorama.positions:
+            attributes = dict(
+                name=position.name,
+                pan=str(position.pan),
+                tilt=str(position.tilt)
+            )
+            xmlPosition = xml.Element("position", attrib=attributes)
+            for capture in position.captures:
+                (roix, roiy, roiw, roih) = capture.roi
+                capAttributes = dict(
+                    name=capture.name,
+                    camera=str(capture.camera),
+                    filter=str(capture.filter),
+                    gain = str(capture.gain),
+                    shutter = str(capture.shutter),
+                    shutter_target = str(capture.shutter_target),
+                    roix = str(roix),
+                    roiy = str(roiy),
+                    roiw = str(roiw),
+                    roih = str(roih),
+                    aeMode = str(capture.aeMode),
+                    aeAlg = str(capture.aeAlg),
+                    aeTarget = str(capture.aeTarget),
+                    aeTol = str(capture.aeTol),
+                    aeMax = str(capture.aeMax),
+                    aeMin = str(capture.aeMin),
+                    aeRate = str(capture.aeRate),
+                    aeOutliers = str(capture.aeOutliers)
+                )
+                xmlCapture = xml.Element("capture", attrib=capAttributes)
+                xmlPosition.append(xmlCapture)
+            xmlRoot.append(xmlPosition)
+        tree = xml.ElementTree(xmlRoot)
+        tree.write(file)
+
+    def load(self, file, optimiser=None):
+        panorama = Panorama(optimiser)
+        # Sorting is the expensive part, so it is done once at the end
+        panorama.extend(self.read(file))
+        return panorama
+
+    def read(self, file):
+        # The positions in file order, either format, told apart by the
+        # first thing in the file
+        with open(file, "rb") as stream:
+            compact = stream.read(1) == b"{"
+        return self.readLines(file) if compact else self.readXml(file)
+
+    def readXml(self, file):
+        # Positions are handed out as they are parsed, and then thrown away,
+        # so the whole tree is never held in memory
+        for (event, element) in xml.iterparse(file):
+            if element.tag != "position":
+                continue
+            position = PanoramaPosition(float(element.get("pan")), float(element.get("tilt")), element.get("name"))
+            for xmlCapture in element.iter("capture"):
+                settings = dict((field, convert(xmlCapture.get(field)))
+                                for (field, convert) in CAPTURE_FIELDS if xmlCapture.get(field) is not None)
+                position.captures.append(Capture(xmlCapture.get("name"), **settings))
+            element.clear()
+            yield position
+
+    def dumpLines(self, panorama, file):
+        # The compact format, a header line and then one JSON array per
+        # position of [name, pan, tilt, captures], each capture being its name
+        # followed by the values of the header's fields
+        fields = [field for (field, convert) in CAPTURE_FIELDS]
+        with open(file, "w") as stream:
+            stream.write(json.dumps(dict(format=COMPACT_FORMAT, version=1, fields=fields)) + "\n")
+            for position in panorama.positions:
+                captures = [[capture.name] + [captureField(capture, field) for field in fields]
+                            for capture in position.captures]
+                stream.write(json.dumps([position.name, position.pan, position.tilt, captures],
+                                        separators=(",", ":")) + "\n")
+
+    def readLines(self, file):
+        with open(file) as stream:
+            header = json.loads(stream.readline())
+            if header.get("format") != COMPACT_FORMAT:
+                raise ValueError("'%s' is not a panorama file" % file)
+            fields = header["fields"]
+            for line in stream:
+                if not line.strip():
+                    continue
+                (name, pan, tilt, captures) = json.loads(line)
+                position = PanoramaPosition(pan, tilt, name)
+                for values in captures:
+                    settings = dict(zip(fields, values[1:]))
+                    position.captures.append(Capture(values[0], **settings))
+                yield position
+
+# Capture attributes as saved, with how to read each back from XML
+CAPTURE_FIELDS = (
+    ("camera", int), ("filter", int), ("gain", lambda value: int(float(value))),
+    ("shutter", float), ("shutter_target", float),
+    ("roix", int), ("roiy", int), ("roiw", int), ("roih", int),
+    ("aeMode", lambda value: int(float(value))), ("aeAlg", lambda value: int(float(value))),
+    ("aeTarget", float), ("aeTol", float), ("aeMax", float), ("aeMin", float),
+    ("aeRate", float), ("aeOutliers", float),
+)
+
+COMPACT_FORMAT = "ace-ng panorama"
+
+def captureField(capture, field):
+    # The ROI is kept as one tuple on the capture but saved as four fields
+    if field.startswith("roi"):
+        return capture.roi["xywh".index(field[3])]
+    return getattr(capture, field)
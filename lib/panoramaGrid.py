@@ -0,0 +1,143 @@
+# -- panoramaGrid.py - Panorama grid generation for ace-ng --
+# Author:     Owen Tourlamain
+# Supervisor: Dr. Laurence Tyler
+
+"""
+panoramaGrid.py
+
+Builds a whole panorama plan from the area to cover, the camera's field of
+view and how much neighbouring frames should overlap, rather than adding
+every position by hand. Rows are spaced by the vertical field of view, and
+each row's pan spacing by the least pan one frame covers anywhere in the
+row, worked out from where the frame's edges actually fall on the sky. That
+grows towards the zenith, so high rows get fewer positions, and a row that
+one frame pointing straight up would cover all of gets just that frame.
+Every position gets its own copy of the template captures.
+
+    from lib.panoramaGrid import buildGrid
+    positions = buildGrid((-60, 60), (-20, 40), (38.3, 38.3), 0.2, template)
+    panorama.extend(positions)
+
+Angles are in degrees, the pan and tilt ranges are the edges of the area to
+cover, not the centres of the outside frames.
+"""
+
+import math
+import numpy
+from lib.panorama import PanoramaPosition
+
+# Position names, rows are counted from the top and columns from the left
+POSITION_NAME = "R%dC%d"
+
+# Frames curve away from a row at their corners, so they always overlap a
+# little or the corners would leave gaps
+MIN_OVERLAP = 0.05
+
+# Tilts each row's coverage is checked at, across its band
+BAND_SAMPLES = 9
+
+def rowCentres(start, end, step):
+    # Centres of equal bands, highest first, covering start to end and no
+    # more than step high, and the height of each band
+    low = min(start, end)
+    high = max(start, end)
+    count = max(1, int(math.ceil((high - low) / step - 1e-9)))
+    band = (high - low) / float(count)
+    return (numpy.linspace(high - band / 2.0, low + band / 2.0, count), band)
+
+def halfWidths(tilts, centres, fov):
+    # How far either side of its own pan a frame pointing at tilt centres
+    # covers at tilts without a gap, 0 if it misses that tilt altogether and
+    # 180 if it covers all the way round. Worked out for whole arrays at once
+    (tilts, centres) = numpy.broadcast_arrays(numpy.radians(tilts), numpy.radians(centres))
+    (cosTilt, sinTilt) = (numpy.cos(tilts), numpy.sin(tilts))
+    (cosCentre, sinCentre) = (numpy.cos(centres), numpy.sin(centres))
+    across = math.tan(math.radians(fov[0] / 2.0))
+    up = math.tan(math.radians(fov[1] / 2.0))
+
+    # Inside the side edges while cos(tilt).sin(pan) - across.(depth) <= 0,
+    # which is a sine wave in pan, so the first pan out of the frame is known
+    amplitude = cosTilt * numpy.sqrt(1 + (across * cosCentre) ** 2)
+    offset = across * sinTilt * sinCentre
+    phase = numpy.arctan2(across * cosCentre, 1.0)
+    with numpy.errstate(divide="ignore", invalid="ignore"):
+        # Right at the pole every pan is the same point, in or out
+        ratio = numpy.where(amplitude > 1e-12, offset / amplitude, numpy.where(offset > 0, numpy.inf, -numpy.inf))
+    sides = numpy.where(ratio >= 1, math.pi,
+                        numpy.where(ratio < -numpy.sin(phase), 0.0, phase + numpy.arcsin(numpy.clip(ratio, -1, 1))))
+
+    # The top and bottom edges each need a.cos(pan) >= b, which only runs out
+    # going round from the frame's centre if a is positive
+    lowest = numpy.full(tilts.shape, -1.0)
+    inside = numpy.ones(tilts.shape, dtype=bool)
+    for (a, b) in ((cosTilt * (sinCentre + up * cosCentre), sinTilt * (cosCentre - up * sinCentre)),
+                   (cosTilt * (up * cosCentre - sinCentre), -sinTilt * (cosCentre + up * sinCentre))):
+        inside &= a >= b - 1e-12
+        lowest = numpy.where(a > 0, numpy.maximum(lowest, b / numpy.where(a > 0, a, 1.0)), lowest)
+    ends = numpy.where(inside, numpy.arccos(numpy.clip(lowest, -1, 1)), 0.0)
+    return numpy.degrees(numpy.minimum(sides, ends))
+
+def gridPositions(panRange, tiltRange, fov, overlap=0.2):
+    # Returns (pans, tilts, rows, columns), one entry per position, worked
+    # out for every row at once
+    (horizontal, vertical) = fov
+    if not 0 <= overlap < 1:
+        raise ValueError("Overlap must be at least 0 and less than 1")
+    if horizontal <= 0 or vertical <= 0:
+        raise ValueError("Field of view must be more than 0")
+    overlap = max(overlap, MIN_OVERLAP)
+    (tilts, band) = rowCentres(tiltRange[0], tiltRange[1], vertical * (1 - overlap))
+    bands = tilts[:, None] + band * numpy.linspace(-0.5, 0.5, BAND_SAMPLES)
+
+    # Each row is spaced for the least pan a frame covers anywhere in its band
+    coverage = numpy.minimum(2 * halfWidths(bands, tilts[:, None], fov).min(axis=1), 360.0)
+    steps = coverage * (1 - overlap)
+
+    panLow = float(min(panRange))
+    panHigh = float(max(panRange))
+    extent = panHigh - panLow
+
+    # A row around the pole only needs one frame, pointing straight at it,
+    # if that frame reaches right down to the bottom of the row
+    poles = numpy.where(tilts >= 0, 90.0, -90.0)
+    poleCoverage = halfWidths(bands, poles[:, None], fov).min(axis=1)
+    zenith = (numpy.abs(tilts) + band / 2.0 >= 90 - 1e-9) & (poleCoverage >= min(extent, 360.0) / 2.0 - 1e-6)
+    if extent >= 360:
+        # All the way round, the first and last columns overlap each other
+        # rather than the ends of the range
+        counts = numpy.ceil(360.0 / steps - 1e-9)
+        spacing = 360.0 / counts
+        starts = panHigh - spacing / 2.0
+    else:
+        spare = numpy.maximum(extent - coverage, 0)
+        counts = numpy.ceil(spare / steps - 1e-9) + 1
+        spacing = numpy.where(counts > 1, spare / numpy.maximum(counts - 1, 1), 0)
+        starts = numpy.where(counts > 1, panHigh - coverage / 2.0, (panLow + panHigh) / 2.0)
+    # One frame pointing at the zenith sees every pan angle
+    counts = numpy.where(zenith | (coverage >= 360), 1, counts).astype(int)
+    starts = numpy.where(zenith | (coverage >= 360), (panLow + panHigh) / 2.0, starts)
+    tilts = numpy.where(zenith, poles, tilts)
+
+    rows = numpy.repeat(numpy.arange(len(tilts)), counts)
+    columns = numpy.arange(counts.sum()) - numpy.repeat(numpy.cumsum(counts) - counts, counts)
+    pans = starts[rows] - spacing[rows] * columns
+    # The PTU doesn't move any more finely than this
+    return (numpy.round(pans, 2), numpy.round(tilts[rows], 2), rows, columns)
+
+def buildGrid(panRange, tiltRange, fov, overlap, captures):
+    # The positions for a grid, each with a copy of captures
+    (pans, tilts, rows, columns) = gridPositions(panRange, tiltRange, fov, overlap)
+    positions = []
+    for (pan, tilt, row, column) in zip(pans.tolist(), tilts.tolist(), rows.tolist(), columns.tolist()):
+        position = PanoramaPosition(pan, tilt, POSITION_NAME % (row + 1, column + 1))
+        position.captures = [capture.copy() for capture in captures]
+        positions.append(position)
+    return positions
+
+def templateFov(config, captures):
+    # The narrowest view of the cameras used, so every capture overlaps
+    cameras = set(capture.camera for capture in captures)
+    if not cameras:
+        raise ValueError("The capture template is empty")
+    views = [config.MIT_CameraFov[camera] for camera in cameras]
+    return (min(view[0] for view in views), min(view[1] for view in views))
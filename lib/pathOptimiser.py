@@ -0,0 +1,249 @@
+# -- pathOptimiser.py - PTU path ordering for ace-ng panoramas --
+# Author:     Owen Tourlamain
+# Supervisor: Dr. Laurence Tyler
+
+import math
+
+class PathOptimiser(object):
+    """
+    pathOptimiser.py
+
+    Orders panorama positions so the PTU spends as little time as possible
+    moving between them. The ordering strategy is looked up by name in
+    STRATEGIES, and every strategy is judged by the same SlewCostModel.
+
+        from lib.pathOptimiser import PathOptimiser, SlewCostModel
+        optimiser = PathOptimiser("nearest", SlewCostModel(panRate=50, tiltRate=25))
+        positions = optimiser.order(positions)
+    """
+
+    def __init__(self, strategy="serpentine", costModel=None, verbose=False):
+        if strategy not in STRATEGIES:
+            raise ValueError("Unknown path strategy '%s'" % strategy)
+        self.strategy = STRATEGIES[strategy]()
+        self.strategyName = strategy
+        self.costModel = costModel if costModel else SlewCostModel()
+        self.verbose = verbose
+
+    def order(self, positions):
+        positions = list(positions)
+        if len(positions) < 2:
+            return positions
+        ordered = self.strategy.order(positions, self.costModel)
+        if self.verbose:
+            print("Estimated PTU travel (%s): %.1fs -> %.1fs" % (self.strategyName,
+                  self.costModel.pathCost(positions), self.costModel.pathCost(ordered)))
+        return ordered
+
+class SlewCostModel(object):
+    """
+    Estimates the time taken to move between two positions. The PTU is asked
+    to pan and then tilt, one after the other, so the two moves add up rather
+    than overlapping. Rates are in degrees per second.
+    """
+
+    def __init__(self, panRate=1.0, tiltRate=1.0):
+        if panRate <= 0 or tiltRate <= 0:
+            raise ValueError("Slew rates must be positive")
+        self.panRate = float(panRate)
+        self.tiltRate = float(tiltRate)
+
+    def cost(self, a, b):
+        return abs(a.pan - b.pan) / self.panRate + abs(a.tilt - b.tilt) / self.tiltRate
+
+    def pathCost(self, positions):
+        total = 0.0
+        for i in range(1, len(positions)):
+            total += self.cost(positions[i - 1], positions[i])
+        return total
+
+    def scaled(self, position):
+        # In these coordinates the cost is just the Manhattan distance
+        return (position.pan / self.panRate, position.tilt / self.tiltRate)
+
+class RasterOrder(object):
+    # Top left to bottom right, every row starting from the same side
+
+    def order(self, positions, costModel):
+        return sorted(positions, key=lambda pos: (pos.tilt, pos.pan), reverse=True)
+
+class SerpentineOrder(object):
+    # Top row left to right, next row right to left and so on
+
+    def __init__(self, rowTolerance=1e-6):
+        self.rowTolerance = rowTolerance
+
+    def order(self, positions, costModel):
+        ordered = []
+        for (index, row) in enumerate(self.rows(positions)):
+            row.sort(key=lambda pos: pos.pan, reverse=(index % 2 == 0))
+            ordered.extend(row)
+        return ordered
+
+    def rows(self, positions):
+        rows = []
+        for position in sorted(positions, key=lambda pos: pos.tilt, reverse=True):
+            if rows and abs(rows[-1][0].tilt - position.tilt) <= self.rowTolerance:
+                rows[-1].append(position)
+            else:
+                rows.append([position])
+        return rows
+
+class NearestNeighbourOrder(object):
+    """
+    Greedy nearest neighbour tour from the top left position, then improved
+    with 2-opt moves limited to each position's closest neighbours. Both steps
+    use a bucket grid so large plans don't need every pair of positions.
+
+    Nearest neighbour does badly on regular grids, so the serpentine order is
+    used as the starting tour instead whenever it is cheaper.
+    """
+
+    def __init__(self, neighbours=8, maxPasses=20):
+        self.neighbours = neighbours
+        self.maxPasses = maxPasses
+
+    def order(self, positions, costModel):
+        start = RasterOrder().order(positions, costModel)[0]
+        coords = [costModel.scaled(position) for position in positions]
+        grid = _Grid(coords)
+        neighbours = [grid.nearest(i, self.neighbours) for i in range(len(coords))]
+        # The tour empties the grid as it goes
+        path = self.nearestNeighbour(positions.index(start), coords, grid)
+        serpentine = SerpentineOrder().order(positions, costModel)
+        if costModel.pathCost(serpentine) < costModel.pathCost([positions[i] for i in path]):
+            lookup = dict((id(position), i) for (i, position) in enumerate(positions))
+            path = [lookup[id(position)] for position in serpentine]
+        path = self.twoOpt(path, coords, neighbours)
+        return [positions[i] for i in path]
+
+    def nearestNeighbour(self, start, coords, grid):
+        path = [start]
+        grid.remove(start)
+        current = start
+        for i in range(len(coords) - 1):
+            current = grid.closest(coords[current])
+            grid.remove(current)
+            path.append(current)
+        return path
+
+    def twoOpt(self, path, coords, neighbours):
+        n = len(path)
+        index = [0] * n
+        for (i, point) in enumerate(path):
+            index[point] = i
+
+        def dist(a, b):
+            return abs(coords[a][0] - coords[b][0]) + abs(coords[a][1] - coords[b][1])
+
+        def gain(i, j):
+            # Gain from reversing path[i+1..j], joining path[i] to path[j].
+            # The end of the path has nothing after it to reconnect
+            if j == n - 1:
+                return dist(path[i], path[i + 1]) - dist(path[i], path[j])
+            return (dist(path[i], path[i + 1]) + dist(path[j], path[j + 1])
+                    - dist(path[i], path[j]) - dist(path[i + 1], path[j + 1]))
+
+        for passes in range(self.maxPasses):
+            improved = False
+            for a in range(n):
+                for b in neighbours[a]:
+                    (i, j) = sorted((index[a], index[b]))
+                    # Either join a and b directly, or join the points just
+                    # before them. The start of the path never moves
+                    for (lo, hi) in ((i, j), (i - 1, j - 1)):
+                        if lo < 0 or hi - lo < 2:
+                            continue
+                        if gain(lo, hi) > 1e-9:
+                            path[lo + 1:hi + 1] = path[lo + 1:hi + 1][::-1]
+                            for k in range(lo + 1, hi + 1):
+                                index[path[k]] = k
+                            improved = True
+                            break
+            if not improved:
+                break
+        return path
+
+class _Grid(object):
+    # Buckets points into square cells, sized to hold a couple of points each
+
+    def __init__(self, coords):
+        self.coords = coords
+        xs = [c[0] for c in coords]
+        ys = [c[1] for c in coords]
+        self.minX = min(xs)
+        self.minY = min(ys)
+        width = max(xs) - self.minX
+        height = max(ys) - self.minY
+        # A single row or column has no area, so fall back to its length
+        self.size = max(math.sqrt(2.0 * width * height / len(coords)),
+                        2.0 * max(width, height) / len(coords), 1e-9)
+        self.cells = {}
+        for (i, coord) in enumerate(coords):
+            self.cells.setdefault(self.cell(coord), set()).add(i)
+        self.span = max(int((max(xs) - self.minX) / self.size), int((max(ys) - self.minY) / self.size)) + 1
+
+    def cell(self, coord):
+        return (int((coord[0] - self.minX) / self.size), int((coord[1] - self.minY) / self.size))
+
+    def remove(self, i):
+        cell = self.cell(self.coords[i])
+        self.cells[cell].discard(i)
+        if not self.cells[cell]:
+            del self.cells[cell]
+
+    def ring(self, centre, radius):
+        (cx, cy) = centre
+        if radius == 0:
+            yield centre
+            return
+        for x in range(cx - radius, cx + radius + 1):
+            yield (x, cy - radius)
+            yield (x, cy + radius)
+        for y in range(cy - radius + 1, cy + radius):
+            yield (cx - radius, y)
+            yield (cx + radius, y)
+
+    def search(self, coord, exclude=None):
+        # Yields (distance, point) one ring of cells at a time, along with the
+        # smallest distance anything outside the rings searched so far can be
+        centre = self.cell(coord)
+        for radius in range(self.span + 1):
+            found = []
+            for cell in self.ring(centre, radius):
+                for i in self.cells.get(cell, ()):
+                    if i != exclude:
+                        other = self.coords[i]
+                        found.append((abs(other[0] - coord[0]) + abs(other[1] - coord[1]), i))
+            yield (found, radius * self.size)
+
+    def closest(self, coord):
+        best = None
+        for (found, bound) in self.search(coord):
+            for candidate in found:
+                if best is None or candidate < best:
+                    best = candidate
+            if best is not None and best[0] <= bound:
+                break
+        return best[1]
+
+    def nearest(self, i, k):
+        found = []
+        for (ring, bound) in self.search(self.coords[i], exclude=i):
+            found.extend(ring)
+            found.sort()
+            if len(found) >= k and found[k - 1][0] <= bound:
+                break
+        return [point for (distance, point) in found[:k]]
+
+STRATEGIES = {
+    "raster": RasterOrder,
+    "serpentine": SerpentineOrder,
+    "nearest": NearestNeighbourOrder,
+}
+
+def optimiserFromConfig(config, verbose=False):
+    # Builds an optimiser with the options from the MIT_ config settings
+    return PathOptimiser(config.MIT_PathStrategy,
+                         SlewCostModel(config.MIT_PanSlewRate, config.MIT_TiltSlewRate),
+                         verbose)
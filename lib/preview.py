@@ -0,0 +1,145 @@
+# -- preview.py - Preview thumbnails for ace-ng --
+# Author:     Owen Tourlamain
+# Supervisor: Dr. Laurence Tyler
+
+import collections
+import threading
+import weakref
+from PyQt5.QtCore import QObject, QRunnable, QThreadPool, pyqtSignal
+from PyQt5.QtGui import QImage, QPixmap
+from PIL import Image
+from lib.tracing import tracer
+
+class PreviewRenderer(QObject):
+    """
+    preview.py
+
+    Shows captured images in preview labels. Each image is shrunk once, in PIL,
+    straight to the size of the label, on a worker thread, and the result is
+    cached so showing the same image again is free. Only the small thumbnail
+    is ever turned into a QImage, where going through ImageQt copied the whole
+    frame (four bytes a pixel for colour) before Qt scaled it down.
+
+    If a label is given a new image before the last one has been rendered,
+    the older one is dropped.
+
+        from lib.preview import PreviewRenderer
+        renderer = PreviewRenderer()
+        renderer.show(camera.get_image(), self.previewLabel)
+    """
+
+    rendered = pyqtSignal(object, object, QImage)
+
+    def __init__(self, cacheSize=16, threads=1):
+        super(PreviewRenderer, self).__init__()
+        self.cache = PreviewCache(cacheSize)
+        self.pool = QThreadPool()
+        self.pool.setMaxThreadCount(threads)
+        # The last request made for each label, anything older is stale
+        self.latest = {}
+        self.rendered.connect(self._rendered)
+
+    def show(self, image, label):
+        size = (label.width(), label.height())
+        cached = self.cache.get(image, size)
+        if cached is not None:
+            self.latest.pop(id(label), None)
+            label.setPixmap(QPixmap.fromImage(cached))
+            return
+        token = object()
+        self.latest[id(label)] = token
+        self.pool.start(_PreviewJob(self, image, size, label, token))
+
+    def wait(self):
+        # Blocks until every queued preview has been rendered
+        self.pool.waitForDone()
+
+    def _rendered(self, label, token, qimage):
+        # Back on the GUI thread, QPixmaps can't be made anywhere else
+        if self.latest.get(id(label)) is not token:
+            return
+        del self.latest[id(label)]
+        label.setPixmap(QPixmap.fromImage(qimage))
+
+class _PreviewJob(QRunnable):
+
+    def __init__(self, renderer, image, size, label, token):
+        super(_PreviewJob, self).__init__()
+        self.renderer = renderer
+        self.image = image
+        self.size = size
+        self.label = label
+        self.token = token
+
+    def run(self):
+        # Stale by the time we got to it, don't bother
+        if self.renderer.latest.get(id(self.label)) is not self.token:
+            return
+        with tracer.span("preview.render", size=self.size):
+            with tracer.span("image.as_pil_image"):
+                pil = self.image.as_pil_image()
+            qimage = thumbnail(pil, self.size)
+        self.renderer.cache.put(self.image, self.size, qimage)
+        self.renderer.rendered.emit(self.label, self.token, qimage)
+
+class PreviewCache(object):
+    """
+    Thumbnails of the most recently shown images. Entries only keep a weak
+    reference to their image, so a cached thumbnail never keeps a full size
+    frame alive, and an entry whose image has gone is never handed out for a
+    new image that happens to get the same id.
+    """
+
+    def __init__(self, size=16):
+        self.size = size
+        self.entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, image, size):
+        with self._lock:
+            entry = self.entries.get((id(image), size))
+            if entry is None or entry[0]() is not image:
+                return None
+            self.entries.move_to_end((id(image), size))
+            return entry[1]
+
+    def put(self, image, size, qimage):
+        try:
+            reference = weakref.ref(image)
+        except TypeError:
+            # No way to tell when it goes, so it can't be cached safely
+            return
+        with self._lock:
+            self.entries[(id(image), size)] = (reference, qimage)
+            self.entries.move_to_end((id(image), size))
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+def thumbnail(pil, size):
+    # Fits the image inside size keeping its aspect ratio, never enlarging it
+    (width, height) = pil.size
+    scale = min(size[0] / width, size[1] / height, 1.0)
+    target = (max(1, int(width * scale)), max(1, int(height * scale)))
+
+    # Averaging whole blocks of pixels is much cheaper than a proper
+    # resample at full size, the small image that leaves is then finished off
+    factor = int(1 / scale)
+    if factor > 1 and hasattr(pil, "reduce"):
+        pil = pil.reduce(factor)
+    if pil.size != target:
+        pil = pil.resize(target, Image.BILINEAR)
+    return toQImage(pil)
+
+def toQImage(pil):
+    if pil.mode == "L":
+        format = QImage.Format_Grayscale8
+        channels = 1
+    else:
+        if pil.mode != "RGB":
+            pil = pil.convert("RGB")
+        format = QImage.Format_RGB888
+        channels = 3
+    data = pil.tobytes()
+    (width, height) = pil.size
+    # copy() so the QImage owns its pixels rather than pointing into data
+    return QImage(data, width, height, width * channels, format).copy()
@@ -0,0 +1,324 @@
+# -- ptuControl.py - Pan/tilt unit command handling for ace-ng --
+# Author:     Owen Tourlamain
+# Supervisor: Dr. Laurence Tyler
+
+import threading
+from PyQt5.QtCore import QObject, QTimer, pyqtSignal
+from lib.tracing import tracer
+
+class PTUState(QObject):
+    """
+    ptuControl.py
+
+    Keeps track of where the PTU has been told to go and where it last said
+    it was, so nothing has to ask it over the network just to find out. Moves
+    should be made through setPan(), setTilt() and stow() so they are
+    tracked. Between start() and stop() a background thread also polls the
+    PTU pollRate times a second to catch anything else, so only start it
+    while someone is watching. changed is emitted whenever the reported
+    position changes, from whichever thread noticed.
+
+    Every user of the PTU should share one, so get it from ptuState().
+
+        from lib.ptuControl import ptuState
+        state = ptuState(api, pollRate=2.0)
+        state.changed.connect(self.showPTUVals)
+        state.start()
+        state.setPan(10)
+        (pan, tilt) = state.position()
+        state.stop()
+    """
+
+    changed = pyqtSignal(float, float)
+    commandChanged = pyqtSignal(float, float)
+    pollFailed = pyqtSignal(str)
+
+    def __init__(self, ptu, pollRate=2.0):
+        super(PTUState, self).__init__()
+        self.ptu = ptu
+        self.pollRate = pollRate
+        self.commanded = (None, None)
+        self.reported = (None, None)
+        self._lock = threading.Lock()
+        # Held while a move is being sent, polls don't compete with moves
+        self._moving = threading.Lock()
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            # Each poller has its own stop flag, one that was stopped without
+            # waiting may still be finishing a poll when the next starts
+            self._stopping = threading.Event()
+            self._thread = threading.Thread(target=self._work, args=(self._stopping,), name="PTUState")
+            self._thread.daemon = True
+            self._thread.start()
+
+    def stop(self, wait=True):
+        if self._thread is not None:
+            self._stopping.set()
+            self._wake.set()
+            if wait:
+                self._thread.join()
+            self._thread = None
+
+    def isPolling(self):
+        return self._thread is not None
+
+    def setPollRate(self, pollRate):
+        self.pollRate = pollRate
+        # A running poller picks the new rate up straight away
+        self._wake.set()
+
+    def position(self):
+        # Best guess at where the PTU is, None for anything we don't know
+        with self._lock:
+            return tuple(reported if reported is not None else commanded
+                         for (reported, commanded) in zip(self.reported, self.commanded))
+
+    def isKnown(self):
+        return None not in self.position()
+
+    def setPan(self, pan):
+        self._command(pan, None)
+        with self._moving:
+            self.ptu.pan = pan
+        # Setting returns once the PTU has arrived, so it's where we said
+        self.report(pan, None)
+
+    def setTilt(self, tilt):
+        self._command(None, tilt)
+        with self._moving:
+            self.ptu.tilt = tilt
+        self.report(None, tilt)
+
+    def stow(self):
+        with self._moving:
+            self.ptu.stow()
+        self.poll()
+
+    def requestPoll(self):
+        # Polls as soon as possible without waiting for it
+        if self.isPolling():
+            self._wake.set()
+        else:
+            thread = threading.Thread(target=self._pollQuietly, name="PTUState-once")
+            thread.daemon = True
+            thread.start()
+
+    def poll(self):
+        with self._moving:
+            self.report(self.ptu.pan, self.ptu.tilt)
+
+    def report(self, pan, tilt):
+        with self._lock:
+            old = self.reported
+            self.reported = (old[0] if pan is None else float(pan), old[1] if tilt is None else float(tilt))
+            new = self.reported
+        if new != old and None not in new:
+            self.changed.emit(new[0], new[1])
+
+    def _command(self, pan, tilt):
+        with self._lock:
+            old = self.commanded
+            self.commanded = (old[0] if pan is None else float(pan), old[1] if tilt is None else float(tilt))
+            new = self.commanded
+        if new != old and None not in new:
+            self.commandChanged.emit(new[0], new[1])
+
+    def _work(self, stopping):
+        while not stopping.is_set():
+            self._wake.wait(1.0 / self.pollRate if self.pollRate > 0 else None)
+            self._wake.clear()
+            if stopping.is_set():
+                return
+            self._pollQuietly()
+
+    def _pollQuietly(self):
+        # Don't queue up behind a move, it will report where it ends up
+        if not self._moving.acquire(False):
+            return
+        try:
+            self.report(self.ptu.pan, self.ptu.tilt)
+        except Exception as error:
+            # Most likely disconnected, try again next time
+            self.pollFailed.emit(str(error))
+        finally:
+            self._moving.release()
+
+# One state per API, shared by everything that moves the PTU
+_states = {}
+
+def ptuState(api, pollRate=None):
+    # pollRate is only changed when given, so callers that don't care about
+    # it can't undo the one from the config whichever asks first
+    key = id(api.pancam)
+    state = _states.get(key)
+    if state is None or state.ptu is not api.pancam.ptu:
+        state = PTUState(api.pancam.ptu, 2.0 if pollRate is None else pollRate)
+        _states[key] = state
+    elif pollRate is not None and pollRate != state.pollRate:
+        state.setPollRate(pollRate)
+    return state
+
+class JogController(QObject):
+    """
+    Turns jog button presses into as few PTU commands as possible. Jogs are
+    added up into a target position on the client, and once no more have
+    arrived for the debounce time the target is sent as one absolute move.
+    Moves are sent from a worker thread, so the GUI never waits on the PTU,
+    and if a newer target arrives while a move is being sent anything left of
+    the old one is dropped in favour of it.
+
+    settled is emitted once the PTU has reached the last target given. If
+    nobody knows where the PTU is yet, jogs and moves wait for a poll rather
+    than asking it there and then, and failed is emitted if the poll fails.
+
+        from lib.ptuControl import JogController, ptuState
+        jog = JogController(ptuState(api), debounce=0.15)
+        jog.settled.connect(self.updatePTUVals)
+        jog.jog(pan=1)
+        jog.jog(pan=1)      # one move of 2 degrees is sent
+    """
+
+    settled = pyqtSignal(float, float)
+    failed = pyqtSignal(str)
+
+    # Queued in place of a target to stow the PTU
+    STOW = "stow"
+
+    def __init__(self, state, debounce=0.15):
+        super(JogController, self).__init__()
+        self.state = state
+        # Where we want the PTU to end up, taken from the state the first time it's needed
+        self.target = None
+        self.timer = QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.setInterval(int(debounce * 1000))
+        self.timer.timeout.connect(self.flush)
+        # Only touched by the worker, what the PTU was last told
+        self.sent = [None, None]
+        # Jogs and moves waiting to find out where the PTU is
+        self.waiting = []
+        self.state.changed.connect(self._positionKnown)
+        self.state.pollFailed.connect(self._pollFailed)
+        self._pending = None
+        self._condition = threading.Condition()
+        self._worker = threading.Thread(target=self._work, name="JogController")
+        self._worker.daemon = True
+        self._worker.start()
+
+    def jog(self, pan=0.0, tilt=0.0):
+        if self.target is None:
+            self.target = self.currentPosition()
+            if self.target is None:
+                self.waiting.append(lambda: self.jog(pan, tilt))
+                return
+        self.target = (self.target[0] + pan, self.target[1] + tilt)
+        # Every jog pushes the move back until the presses stop
+        self.timer.start()
+
+    def moveTo(self, pan=None, tilt=None):
+        # Absolute moves go straight away, along with any jogs still waiting
+        if self.target is None and (pan is None or tilt is None):
+            self.target = self.currentPosition()
+            if self.target is None:
+                self.waiting.append(lambda: self.moveTo(pan, tilt))
+                return
+        elif self.target is None:
+            self.target = (pan, tilt)
+        self.target = (self.target[0] if pan is None else pan,
+                       self.target[1] if tilt is None else tilt)
+        self.flush()
+
+    def stow(self):
+        self.timer.stop()
+        # We won't know where we are until the PTU tells us
+        self.target = None
+        self.waiting = []
+        self._queue(self.STOW)
+
+    def currentPosition(self):
+        # None if nobody has found out where the PTU is yet, a poll is asked
+        # for without waiting on it
+        if not self.state.isKnown():
+            self.state.requestPoll()
+            return None
+        return self.state.position()
+
+    def _positionKnown(self, pan, tilt):
+        waiting = self.waiting
+        self.waiting = []
+        for command in waiting:
+            command()
+
+    def _pollFailed(self, error):
+        # Only our problem if something was waiting on it
+        if self.waiting:
+            self.waiting = []
+            self.failed.emit(error)
+
+    def flush(self):
+        self.timer.stop()
+        if self.target is not None:
+            self._queue(self.target)
+
+    def reset(self):
+        # Call when something else may have moved the PTU
+        if not self.isBusy() and not self.waiting:
+            self.target = None
+            self.sent = [None, None]
+
+    def isBusy(self):
+        with self._condition:
+            return self.timer.isActive() or self._pending is not None
+
+    def _queue(self, command):
+        with self._condition:
+            # Replaces anything the worker hasn't got to yet
+            self._pending = command
+            self._condition.notify()
+
+    def _work(self):
+        while True:
+            with self._condition:
+                while self._pending is None:
+                    self._condition.wait()
+                command = self._pending
+                self._pending = None
+            try:
+                if command == self.STOW:
+                    with tracer.span("ptu.stow"):
+                        self.state.stow()
+                    self.sent = [None, None]
+                    position = self.state.position()
+                elif not self._send(command):
+                    # Superseded part way through, go straight to the new target
+                    continue
+                else:
+                    position = command
+            except Exception as error:
+                # The PTU may have stopped anywhere
+                self.sent = [None, None]
+                self.failed.emit(str(error))
+                continue
+            with self._condition:
+                if self._pending is None:
+                    self.settled.emit(position[0], position[1])
+
+    def _send(self, target):
+        # Returns False if a newer target arrived before we finished
+        (pan, tilt) = target
+        if self.sent[0] != pan:
+            with tracer.span("ptu.pan", pan=pan):
+                self.state.setPan(pan)
+            self.sent[0] = pan
+        with self._condition:
+            if self._pending is not None:
+                return False
+        if self.sent[1] != tilt:
+            with tracer.span("ptu.tilt", tilt=tilt):
+                self.state.setTilt(tilt)
+            self.sent[1] = tilt
+        return True
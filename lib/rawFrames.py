@@ -0,0 +1,120 @@
+# -- rawFrames.py - Raw frame output and PNG conversion for ace-ng --
+# Author:     Owen Tourlamain
+# Supervisor: Dr. Laurence Tyler
+
+"""
+rawFrames.py
+
+Writes captured frames as the sensor data straight to disk, with the image
+size, mode and metadata in a JSON file beside it, so no time is spent
+compressing during capture. The pair can be turned into the usual PNG with
+metadata afterwards, convertTree() does a whole run using every core.
+
+    from lib.rawFrames import writeRaw, convertTree
+    writeRaw(image, "/data/pan1/TL/LWAC-Red_0_3.raw")
+    convertTree("/data/pan1")
+
+For LWAC-Red_0_3.raw the header is LWAC-Red_0_3.json, and conversion makes
+LWAC-Red_0_3.png.
+"""
+
+import os
+import json
+import multiprocessing
+from PIL import Image
+from PIL.PngImagePlugin import PngInfo
+
+RAW_EXTENSION = ".raw"
+HEADER_EXTENSION = ".json"
+
+def headerName(rawName):
+    return os.path.splitext(rawName)[0] + HEADER_EXTENSION
+
+def pngName(rawName):
+    return os.path.splitext(rawName)[0] + ".png"
+
+def writeRaw(image, rawName):
+    pil = image.as_pil_image()
+    header = dict(
+        mode=pil.mode,
+        size=list(pil.size),
+        metadata=dict((str(key), str(value)) for (key, value) in (getattr(image, "metadata", None) or {}).items()),
+    )
+    # Pixels first, then the header, the header is what marks the pair as complete
+    writeUnbuffered(rawName, pil.tobytes())
+    writeUnbuffered(headerName(rawName), json.dumps(header, sort_keys=True).encode())
+
+def writeUnbuffered(fileName, data):
+    # Straight to the file descriptor, no copy into a Python file buffer
+    file = os.open(fileName, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        view = memoryview(data)
+        while view:
+            written = os.write(file, view)
+            view = view[written:]
+    finally:
+        os.close(file)
+
+def readRaw(rawName):
+    with open(headerName(rawName)) as file:
+        header = json.load(file)
+    with open(rawName, "rb") as file:
+        data = file.read()
+    image = Image.frombytes(header["mode"], tuple(header["size"]), data)
+    return (image, header["metadata"])
+
+def convertFile(rawName, remove=False):
+    # Returns the name of the PNG written
+    (image, metadata) = readRaw(rawName)
+    info = pngInfo(metadata)
+    output = pngName(rawName)
+    # Written under another name first so a PNG is never left half done
+    partial = output + ".part"
+    image.save(partial, format="PNG", pnginfo=info)
+    os.replace(partial, output)
+    if remove:
+        os.remove(rawName)
+        os.remove(headerName(rawName))
+    return output
+
+def pngInfo(metadata):
+    # The metadata as PNG text chunks, the same as save_png_with_metadata()
+    info = PngInfo()
+    for (key, value) in sorted(metadata.items()):
+        info.add_text(key, value)
+    return info
+
+def findRaw(path):
+    # Only frames with a header, a raw file without one was never finished
+    found = []
+    for (directory, directories, files) in os.walk(path):
+        for name in sorted(files):
+            if name.endswith(RAW_EXTENSION) and os.path.exists(headerName(os.path.join(directory, name))):
+                found.append(os.path.join(directory, name))
+    return found
+
+def _convert(job):
+    (rawName, remove) = job
+    try:
+        return (rawName, convertFile(rawName, remove), None)
+    except Exception as error:
+        return (rawName, None, str(error))
+
+def convertTree(path, processes=None, remove=False, progress=None):
+    # Converts every raw frame under path, calling progress(rawName, pngName, error)
+    # as each is done, and returns the number that failed
+    jobs = [(rawName, remove) for rawName in findRaw(path)]
+    failed = 0
+    if not jobs:
+        return failed
+    pool = multiprocessing.Pool(processes or multiprocessing.cpu_count())
+    try:
+        for (rawName, output, error) in pool.imap_unordered(_convert, jobs):
+            if error:
+                failed += 1
+            if progress:
+                progress(rawName, output, error)
+    finally:
+        pool.close()
+        pool.join()
+    return failed
@@ -0,0 +1,252 @@
+# -- simulatedApi.py - In-process simulated AUPE for ace-ng --
+# Author:     Owen Tourlamain
+# Supervisor: Dr. Laurence Tyler
+
+"""
+simulatedApi.py
+
+Pure Python stand-in for lib.au.pancam_api, with the same module level
+system and pancam objects the extensions use. Frames are synthetic but come
+out at the sensor resolutions, and every call waits as long as the model says
+the hardware would, so capture throughput can be measured on any machine.
+
+    from lib import simulatedApi as api
+    api.configure(rpcLatency=0.005, panRate=30.0)
+    api.system.connect(agent_addr="127.0.0.1")
+    api.pancam.setup_cameras()
+    image = api.pancam.cameras[0].get_image()
+"""
+
+import io
+import random
+import threading
+import time
+from lib.stageTimings import StageTimings
+from PIL import Image
+from PIL.PngImagePlugin import PngInfo
+
+class LatencyModel(object):
+    # Times are in seconds, rates in degrees per second and bytes per second
+
+    def __init__(self):
+        self.rpcLatency = 0.002
+        self.panRate = 50.0
+        self.tiltRate = 25.0
+        self.settleTime = 0.05
+        self.wheelStepTime = 0.1
+        self.transferRate = 40e6
+        # Shutter values are treated as milliseconds
+        self.shutterScale = 0.001
+        self.timeScale = 1.0
+        # Where the simulated hardware spent its time, for benchmarking
+        self.phases = StageTimings()
+
+    def wait(self, seconds):
+        # timeScale lets benchmarks run the same model faster than real time
+        if seconds > 0 and self.timeScale > 0:
+            time.sleep(seconds * self.timeScale)
+
+model = LatencyModel()
+
+def configure(**kwargs):
+    for (name, value) in kwargs.items():
+        if not hasattr(model, name):
+            raise AttributeError("Unknown latency setting '%s'" % name)
+        setattr(model, name, value)
+
+class SimulatedSystem(object):
+
+    def __init__(self):
+        self.connected = False
+
+    def connect(self, agent_addr=None):
+        model.wait(model.rpcLatency)
+        self.agent_addr = agent_addr
+        self.connected = True
+
+    def disconnect(self):
+        self.connected = False
+
+class SimulatedPTU(object):
+
+    def __init__(self):
+        self._pan = 0.0
+        self._tilt = 0.0
+        # The real PTU only does one thing at a time
+        self._lock = threading.Lock()
+
+    @property
+    def pan(self):
+        model.wait(model.rpcLatency)
+        return self._pan
+
+    @pan.setter
+    def pan(self, value):
+        with self._lock:
+            model.wait(model.rpcLatency + abs(value - self._pan) / model.panRate + model.settleTime)
+            self._pan = float(value)
+
+    @property
+    def tilt(self):
+        model.wait(model.rpcLatency)
+        return self._tilt
+
+    @tilt.setter
+    def tilt(self, value):
+        with self._lock:
+            model.wait(model.rpcLatency + abs(value - self._tilt) / model.tiltRate + model.settleTime)
+            self._tilt = float(value)
+
+    def stow(self):
+        self.pan = 0.0
+        self.tilt = 0.0
+
+class SimulatedCamera(object):
+
+    DEFAULTS = dict(
+        filter=0, gain=0, shutter=100.0, shutter_target=0.5, roi=(0, 0, 0, 0),
+        ae_meter_region=0, shutter_mode=0, ae_algorithm=0, ae_target=0.5,
+        ae_tolerance=0.05, ae_max_shutter=1000.0, ae_min_shutter=0.1,
+        ae_adjust_rate=0.5, ae_outliers=0.01
+    )
+
+    def __init__(self, name, number, size, mode, wheelSize, ptu):
+        # Our own attributes have to bypass __setattr__
+        object.__setattr__(self, "name", name)
+        object.__setattr__(self, "number", number)
+        object.__setattr__(self, "size", size)
+        object.__setattr__(self, "mode", mode)
+        object.__setattr__(self, "wheelSize", wheelSize)
+        object.__setattr__(self, "ptu", ptu)
+        object.__setattr__(self, "_settings", dict(self.DEFAULTS))
+        object.__setattr__(self, "_lock", threading.Lock())
+
+    def __getattr__(self, name):
+        settings = self.__dict__["_settings"]
+        if name not in settings:
+            raise AttributeError(name)
+        model.wait(model.rpcLatency)
+        return settings[name]
+
+    def __setattr__(self, name, value):
+        if name not in self._settings:
+            raise AttributeError("Camera has no setting '%s'" % name)
+        with self._lock:
+            wait = model.rpcLatency
+            if name == "filter" and self.wheelSize:
+                steps = abs(int(value) - int(self._settings["filter"])) % self.wheelSize
+                wait += min(steps, self.wheelSize - steps) * model.wheelStepTime
+            model.wait(wait)
+            self._settings[name] = value
+
+    def get_image(self, ae=False):
+        with self._lock:
+            settings = self._settings
+            if ae:
+                # Server AE, one extra exposure per iteration until in tolerance
+                self._serverAE(settings)
+            with model.phases.timed("expose"):
+                model.wait(model.rpcLatency + settings["shutter"] * model.shutterScale)
+            with model.phases.timed("transfer"):
+                image = SimulatedImage(self, dict(settings), self.ptu._pan, self.ptu._tilt)
+                image.as_pil_image()
+                model.wait(image.byteCount() / model.transferRate)
+            return image
+
+    def _serverAE(self, settings):
+        target = settings["ae_target"] or 0.5
+        tolerance = settings["ae_tolerance"] or 0.05
+        rate = settings["ae_adjust_rate"] or 0.5
+        low = settings["ae_min_shutter"] or 0.01
+        high = settings["ae_max_shutter"] or 1000.0
+        shutter = settings["shutter"] or low
+        iterations = 0
+        for iterations in range(1, 50):
+            model.wait(model.rpcLatency + shutter * model.shutterScale)
+            level = sceneLevel(self.ptu._pan, self.ptu._tilt, settings["filter"]) * shutter * (1 + settings["gain"]) / 100.0
+            level = min(level, 1.0)
+            if abs(level - target) <= tolerance:
+                break
+            # Nothing more we can do if the shutter is already at its limit
+            if (level < target and shutter >= high) or (level > target and shutter <= low):
+                break
+            # Move part of the way towards the shutter that would hit the target
+            wanted = shutter * target / max(level, 1e-3)
+            shutter = min(max(shutter + (wanted - shutter) * rate, low), high)
+        settings["shutter"] = shutter
+        object.__setattr__(self, "aeIterations", iterations)
+
+def sceneLevel(pan, tilt, filter):
+    # Average brightness of the fake scene at one shutter unit, brighter
+    # towards the sky and varying gently with pan and filter
+    return max(0.05, 0.5 + tilt / 180.0 + 0.1 * ((pan / 30.0) % 1.0) - 0.02 * filter)
+
+class SimulatedImage(object):
+
+    def __init__(self, camera, settings, pan, tilt):
+        self.camera = camera.name
+        self.size = camera.size
+        self.mode = camera.mode
+        self.settings = settings
+        self.pan = pan
+        self.tilt = tilt
+        self.timestamp = time.time()
+        self.metadata = dict(
+            camera=camera.name, pan=str(pan), tilt=str(tilt), time=str(self.timestamp),
+            **dict((name, str(value)) for (name, value) in settings.items())
+        )
+        self._pil = None
+
+    def byteCount(self):
+        return self.size[0] * self.size[1] * len(self.mode)
+
+    def as_pil_image(self):
+        if self._pil is None:
+            self._pil = self._render()
+        return self._pil
+
+    def save_png_with_metadata(self, fileName):
+        info = PngInfo()
+        for (key, value) in sorted(self.metadata.items()):
+            info.add_text(key, value)
+        # Encoded in memory first so the two costs can be told apart
+        with model.phases.timed("encode"):
+            data = io.BytesIO()
+            self.as_pil_image().save(data, format="PNG", pnginfo=info)
+        with model.phases.timed("write"):
+            with open(fileName, "wb") as file:
+                file.write(data.getvalue())
+
+    def _render(self):
+        # A coarse random pattern scaled up to full size, seeded by where we
+        # are pointing so the same position always looks the same
+        rng = random.Random("%s %.2f %.2f %s" % (self.camera, self.pan, self.tilt, self.settings["filter"]))
+        level = sceneLevel(self.pan, self.tilt, self.settings["filter"])
+        exposure = level * self.settings["shutter"] * (1 + self.settings["gain"]) / 100.0
+        coarse = Image.new("L", (32, 32))
+        coarse.putdata([min(255, int(255 * exposure * rng.uniform(0.5, 1.5))) for i in range(32 * 32)])
+        image = coarse.resize(self.size, Image.BILINEAR)
+        if self.mode != "L":
+            image = Image.merge(self.mode, [image] * len(self.mode))
+        return image
+
+class SimulatedPancam(object):
+
+    # Names, sizes and filter wheels of the cameras, in pancam_api order
+    CAMERAS = (
+        ("LWAC", (1024, 1024), "L", 11),
+        ("RWAC", (1024, 1024), "L", 11),
+        ("HRC", (1024, 1024), "RGB", 0),
+    )
+
+    def __init__(self):
+        self.ptu = SimulatedPTU()
+        self.cameras = []
+
+    def setup_cameras(self):
+        model.wait(model.rpcLatency)
+        self.cameras = [SimulatedCamera(name, number, size, mode, wheelSize, self.ptu)
+                        for (number, (name, size, mode, wheelSize)) in enumerate(self.CAMERAS)]
+
+system = SimulatedSystem()
+pancam = SimulatedPancam()
@@ -0,0 +1,49 @@
+# -- stageTimings.py - Per stage timing totals for ace-ng --
+# Author:     Owen Tourlamain
+# Supervisor: Dr. Laurence Tyler
+
+import threading
+import time
+
+class StageTimings(object):
+    """
+    stageTimings.py
+
+    Thread safe totals of the time spent in each stage of a capture run.
+    Kept apart from the capture engine so the simulated AUPE can use it too
+    without importing the code it stands in for.
+
+        from lib.stageTimings import StageTimings
+        timings = StageTimings()
+        with timings.timed("move"):
+            ptu.pan = 10
+    """
+
+    def __init__(self):
+        self.totals = {}
+        self._lock = threading.Lock()
+
+    def add(self, stage, seconds):
+        with self._lock:
+            self.totals[stage] = self.totals.get(stage, 0.0) + seconds
+
+    def timed(self, stage):
+        return _Timer(self, stage)
+
+    def __str__(self):
+        with self._lock:
+            return "\n".join("%s: %.2fs" % (stage, self.totals[stage]) for stage in sorted(self.totals))
+
+class _Timer(object):
+
+    def __init__(self, timings, stage):
+        self.timings = timings
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.timings.add(self.stage, time.perf_counter() - self.start)
+        return False
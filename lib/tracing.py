@@ -0,0 +1,125 @@
+# -- tracing.py - Timing spans for ace-ng --
+# Author:     Owen Tourlamain
+# Supervisor: Dr. Laurence Tyler
+
+import json
+import os
+import threading
+import time
+
+class Tracer(object):
+    """
+    tracing.py
+
+    Records timing spans around hardware and disk operations, so a slow run
+    can be broken down afterwards. Tracing is off by default, and when it is
+    off span() hands back a shared do-nothing object so the instrumented code
+    costs next to nothing.
+
+    Spans can be saved as JSON lines, or as a Chrome trace-event file to load
+    into chrome://tracing or Perfetto.
+
+        from lib.tracing import tracer
+        tracer.enable()
+        with tracer.span("ptu.pan", pan=10):
+            ptu.pan = 10
+        tracer.exportChromeTrace("run.trace.json")
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.spans = []
+        self.epoch = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def enable(self):
+        self.epoch = time.perf_counter()
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def clear(self):
+        with self._lock:
+            self.spans = []
+
+    def span(self, name, **args):
+        if not self.enabled:
+            return _NO_SPAN
+        return _Span(self, name, args)
+
+    def now(self):
+        return time.perf_counter()
+
+    def record(self, name, start, end, args=None):
+        # For spans that start and end in different places, or on different threads
+        if not self.enabled:
+            return
+        thread = threading.current_thread()
+        span = dict(
+            name=name,
+            start=start - self.epoch,
+            duration=end - start,
+            thread=thread.name,
+            tid=thread.ident,
+            args=args if args else {},
+        )
+        with self._lock:
+            self.spans.append(span)
+
+    def exportJsonl(self, fileName):
+        with self._lock:
+            spans = list(self.spans)
+        with open(fileName, "w") as file:
+            for span in spans:
+                file.write(json.dumps(span, sort_keys=True, default=str) + "\n")
+
+    def exportChromeTrace(self, fileName):
+        with self._lock:
+            spans = list(self.spans)
+        pid = os.getpid()
+        # Complete ("X") events, times in microseconds
+        events = [dict(name=span["name"], cat=span["name"].split(".")[0], ph="X",
+                       ts=span["start"] * 1e6, dur=span["duration"] * 1e6,
+                       pid=pid, tid=span["tid"], args=span["args"]) for span in spans]
+        # Name the threads so the viewer shows something readable
+        threads = dict((span["tid"], span["thread"]) for span in spans)
+        for (tid, name) in threads.items():
+            events.append(dict(name="thread_name", ph="M", pid=pid, tid=tid, args=dict(name=name)))
+        with open(fileName, "w") as file:
+            json.dump(dict(traceEvents=events, displayTimeUnit="ms"), file, default=str)
+
+    def export(self, base):
+        # Writes both formats, base.jsonl and base.trace.json
+        self.exportJsonl(base + ".jsonl")
+        self.exportChromeTrace(base + ".trace.json")
+
+class _Span(object):
+
+    def __init__(self, tracer, name, args):
+        self.tracer = tracer
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, excType, exc, traceback):
+        if excType is not None:
+            self.args["error"] = excType.__name__
+        self.tracer.record(self.name, self.start, time.perf_counter(), self.args)
+        return False
+
+class _NoSpan(object):
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+_NO_SPAN = _NoSpan()
+
+# Shared by everything in the process
+tracer = Tracer()
@@ -0,0 +1,76 @@
+# -- test_panoramaGrid.py - Tests for grid generation in ace-ng --
+# Author:     Owen Tourlamain
+# Supervisor: Dr. Laurence Tyler
+
+import os
+import sys
+import unittest
+import numpy
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from lib.panoramaGrid import gridPositions
+
+def direction(pans, tilts):
+    # Unit vectors for pan and tilt angles in degrees
+    (pans, tilts) = (numpy.radians(pans), numpy.radians(tilts))
+    return numpy.stack([numpy.cos(tilts) * numpy.cos(pans), numpy.cos(tilts) * numpy.sin(pans), numpy.sin(tilts)], -1)
+
+def uncovered(panRange, tiltRange, fov, overlap, cell=1.0):
+    # The centres of the cell by cell squares of the area that no frame of
+    # the grid takes in, projecting each one into every frame like a camera
+    (pans, tilts, rows, columns) = gridPositions(panRange, tiltRange, fov, overlap)
+    cellPans = numpy.arange(min(panRange) + cell / 2.0, max(panRange), cell)
+    cellTilts = numpy.arange(min(tiltRange) + cell / 2.0, max(tiltRange), cell)
+    (cellPans, cellTilts) = [axis.ravel() for axis in numpy.meshgrid(cellPans, cellTilts)]
+    cells = direction(cellPans, cellTilts)
+    covered = numpy.zeros(len(cells), dtype=bool)
+    (across, up) = numpy.tan(numpy.radians(numpy.array(fov) / 2.0))
+    for (pan, tilt) in zip(pans, tilts):
+        forward = direction(pan, tilt)
+        right = numpy.array([-numpy.sin(numpy.radians(pan)), numpy.cos(numpy.radians(pan)), 0.0])
+        depth = cells.dot(forward)
+        covered |= (depth > 0) & (numpy.abs(cells.dot(right)) <= across * depth) & \
+                   (numpy.abs(cells.dot(numpy.cross(right, forward))) <= up * depth)
+    return list(zip(cellPans[~covered].tolist(), cellTilts[~covered].tolist()))
+
+class GridCoverageTest(unittest.TestCase):
+
+    def assertCovered(self, panRange, tiltRange, fov, overlap=0.2):
+        missed = uncovered(panRange, tiltRange, fov, overlap)
+        self.assertEqual(missed[:5], [], "%d cells not covered" % len(missed))
+
+    def testPartial(self):
+        self.assertCovered((-60, 60), (-20, 40), (38.3, 38.3))
+
+    def testUpToZenith(self):
+        self.assertCovered((-180, 180), (-30, 90), (38.3, 38.3))
+
+    def testWholeSphere(self):
+        self.assertCovered((-180, 180), (-90, 90), (38.3, 38.3))
+
+    def testNarrowView(self):
+        self.assertCovered((-180, 180), (0, 90), (4.88, 4.88))
+
+    def testWideView(self):
+        self.assertCovered((0, 360), (60, 90), (38.3, 20))
+
+    def testNoOverlap(self):
+        self.assertCovered((-180, 180), (-90, 90), (50, 30), 0.0)
+
+    def testPartialToZenith(self):
+        self.assertCovered((-90, 90), (20, 90), (38.3, 38.3), 0.1)
+
+    def testZenithRowNeedsColumns(self):
+        # A frame pointing straight up can't reach down to this row's bottom
+        (pans, tilts, rows, columns) = gridPositions((-180, 180), (-30, 90), (38.3, 38.3), 0.2)
+        self.assertGreater((rows == 0).sum(), 1)
+        self.assertNotIn(90.0, tilts.tolist())
+
+    def testZenithFrame(self):
+        # Here it can, so one frame pointing at the zenith is all that's needed
+        (pans, tilts, rows, columns) = gridPositions((-180, 180), (80, 90), (38.3, 38.3), 0.2)
+        self.assertEqual(tilts.tolist(), [90.0])
+        self.assertCovered((-180, 180), (80, 90), (38.3, 38.3))
+
+if __name__ == "__main__":
+    unittest.main()